@@ -0,0 +1,71 @@
+# plotter
+# benchmarks/common.py
+#
+# Helpers shared by the benchmark scripts. They are run from anywhere with
+# e.g. "python benchmarks/open_keys.py", and import plotter from the checkout.
+
+import os
+import sys
+import time
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def peak_rss():
+    """ Peak resident memory of this process, in MB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def timed(func, *args, repeat=1):
+    """ (best time in s, result of the last call) """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def _run_child(queue, func, args):
+    try:
+        elapsed, result = timed(func, *args)
+        queue.put((elapsed, peak_rss(), result, None))
+    except Exception as e:
+        queue.put((None, peak_rss(), None, repr(e)))
+
+
+def isolated(func, *args):
+    """
+    Run func(*args) in a new process, so that the memory it uses is not
+    mixed with the other cases. Returns (time in s, peak RSS in MB, result),
+    func must be importable and its result picklable.
+    """
+
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+
+    process = ctx.Process(target=_run_child, args=(queue, func, args))
+    process.start()
+    elapsed, rss, result, error = queue.get()
+    process.join()
+
+    if error is not None:
+        raise RuntimeError(error)
+
+    return elapsed, rss, result
+
+
+def data_path(name, directory=None):
+    """ Path of a generated input file, kept between runs """
+
+    if directory is None:
+        directory = os.environ.get('PLOTTER_BENCH_DIR', '/tmp/plotter-bench')
+
+    os.makedirs(directory, exist_ok=True)
+
+    return os.path.join(directory, name)
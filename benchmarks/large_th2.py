@@ -0,0 +1,100 @@
+# plotter
+# benchmarks/large_th2.py
+#
+# Draw latency and peak RSS for a large TH2 read from a file: with the two
+# Clone() of the old get_object -> draw path, and with the objects handed
+# over without a copy (RootFile.get_objects). Each case runs in a new process.
+#
+#   python benchmarks/large_th2.py [--bins 1000]
+
+import os
+import argparse
+
+from common import isolated, data_path
+
+
+def make_file(path, nbins):
+
+    from plotter.backends import load_root
+    ROOT = load_root()
+
+    ROOT.TH1.AddDirectory(False)
+
+    h = ROOT.TH2D('h2', 'h2', nbins, 0, 1, nbins, 0, 1)
+    h.Sumw2()
+    rnd = ROOT.TRandom3(1)
+    for _ in range(10 * nbins * nbins // 100):
+        h.Fill(rnd.Rndm(), rnd.Rndm(), rnd.Rndm())
+
+    f = ROOT.TFile(path, 'RECREATE')
+    f.WriteTObject(h)
+    f.Close()
+
+
+def draw(obj):
+
+    from plotter.backends import load_root
+    from plotter.plot import Plot
+
+    ROOT = load_root()
+    ROOT.gROOT.SetBatch(True)
+
+    plot = Plot('h2')
+    plot.add(obj, 'blue', ['colz'])
+    plot.create()
+    plot.canvas.Update()
+
+    return obj.GetNcells()
+
+
+def draw_cloned(path):
+    """ The old path: a Clone in get_object and another one before drawing """
+
+    from plotter.backends import load_root
+    ROOT = load_root()
+
+    f = ROOT.TFile.Open(path)
+    obj = f.Get('h2').Clone()
+
+    return draw(obj.Clone())
+
+
+def draw_owned(path):
+
+    from plotter.backends import open_file, to_root
+
+    f = open_file(path, 'root')
+
+    return draw(to_root(f.get_objects([('h2', '', None)])[0]))
+
+
+def load_only(path):
+    """ Memory used by the same imports, without a histogram """
+
+    import plotter.plot
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='draw latency and memory of a large TH2')
+    parser.add_argument('--bins', type=int, default=1000, help='bins per axis')
+    args = parser.parse_args()
+
+    path = data_path('th2_%i.root' % args.bins)
+    if not os.path.exists(path):
+        print('writing %s' % path)
+        isolated(make_file, path, args.bins)
+
+    cases = [
+        ('import only', load_only),
+        ('two Clone()', draw_cloned),
+        ('no copy', draw_owned),
+    ]
+
+    print('TH2D %ix%i with Sumw2: %.0f MB in memory' % (args.bins, args.bins, 2 * 8 * (args.bins + 2) ** 2 / 1024 / 1024))
+    print('%-14s %10s %14s' % ('', 'time (s)', 'peak RSS (MB)'))
+    for label, func in cases:
+        elapsed, rss, _ = isolated(func, path)
+        print('%-14s %10.2f %14.0f' % (label, elapsed, rss))
@@ -0,0 +1,103 @@
+# plotter
+# benchmarks/open_keys.py
+#
+# Open time and peak RSS of listing a file with many histograms: reading
+# every object (what browse_dir used to do) against classifying the keys
+# from their class names (RootFile), with and without the index cache.
+#
+#   python benchmarks/open_keys.py [--keys 50000] [--bins 1000]
+
+import os
+import argparse
+import tempfile
+
+from common import isolated, data_path
+
+
+def make_file(path, nkeys, nbins, per_dir=500):
+
+    from plotter.backends import load_root
+    ROOT = load_root()
+
+    ROOT.TH1.AddDirectory(False)
+
+    f = ROOT.TFile(path, 'RECREATE')
+
+    for i in range(nkeys):
+        if i % per_dir == 0:
+            d = f.mkdir('dir%i' % (i // per_dir))
+
+        h = ROOT.TH1D('h%i' % i, 'h%i' % i, nbins, 0, 1)
+        h.SetBinContent(i % nbins + 1, i)
+        d.WriteTObject(h)
+
+    f.Close()
+
+
+def list_read_objects(path):
+    """ The old listing: every key is read to get its class """
+
+    from plotter.backends import load_root
+    ROOT = load_root()
+
+    f = ROOT.TFile.Open(path)
+
+    objects = []
+    def walk(cdir):
+        n = 0
+        for key in cdir.GetListOfKeys():
+            obj = key.ReadObj()
+            objects.append(obj)
+            n += 1
+            if obj.InheritsFrom('TDirectory'):
+                n += walk(obj)
+        return n
+
+    return walk(f)
+
+
+def list_keys(path, index_db=None):
+
+    from plotter.backends import open_file
+    from plotter.cache import IndexCache
+
+    index_cache = IndexCache(index_db) if index_db else None
+
+    return sum(1 for _ in open_file(path, 'root', index_cache))
+
+
+def load_only():
+
+    from plotter.backends import load_root
+    load_root()
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='open time and peak RSS of the file listing')
+    parser.add_argument('--keys', type=int, default=50000)
+    parser.add_argument('--bins', type=int, default=1000)
+    args = parser.parse_args()
+
+    path = data_path('keys_%i_%i.root' % (args.keys, args.bins))
+    if not os.path.exists(path):
+        print('writing %s' % path)
+        isolated(make_file, path, args.keys, args.bins)
+
+    index_db = os.path.join(tempfile.mkdtemp(), 'index.db')
+
+    cases = [
+        ('import ROOT only', load_only),
+        ('ReadObj on every key', list_read_objects, path),
+        ('key class names', list_keys, path),
+        ('index cache, cold', list_keys, path, index_db),
+        ('index cache, warm', list_keys, path, index_db),
+    ]
+
+    print('%i keys of TH1D(%i): %.1f MB' % (args.keys, args.bins, os.path.getsize(path) / 1024 / 1024))
+    print('%-24s %10s %12s %10s' % ('', 'time (s)', 'peak RSS (MB)', 'entries'))
+    for label, func, *func_args in cases:
+        elapsed, rss, n = isolated(func, *func_args)
+        print('%-24s %10.2f %12.0f %10i' % (label, elapsed, rss, n))
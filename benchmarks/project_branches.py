@@ -0,0 +1,61 @@
+# plotter
+# benchmarks/project_branches.py
+#
+# Projection time of 1 to 20 branches of the same tree: one TTree::Draw per
+# branch against all the branches filled in one event loop (RootFile.project).
+#
+#   python benchmarks/project_branches.py [--entries 5000000] [--auto] [--selection 'b0>50']
+
+import os
+import argparse
+
+from common import timed, isolated, data_path
+
+NBRANCHES = (1, 2, 4, 8, 12, 16, 20)
+
+
+def make_tree(path, nentries, nbranches=max(NBRANCHES)):
+
+    from plotter.backends import load_root
+    ROOT = load_root()
+
+    # deterministic values spread over [0, 100)
+    df = ROOT.RDataFrame(nentries)
+    for i in range(nbranches):
+        df = df.Define('b%i' % i, '(double)((rdfentry_ * %iULL + %i) %% 100003) / 1000.03' % (2654435761 + 2 * i, i))
+
+    df.Snapshot('tree', path)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='speedup of the single event loop projection')
+    parser.add_argument('--entries', type=int, default=5000000)
+    parser.add_argument('--auto', action='store_true', help='automatic binning instead of (100, 0, 100)')
+    parser.add_argument('--selection', default='')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    path = data_path('tree_%i.root' % args.entries)
+    if not os.path.exists(path):
+        print('writing %s' % path)
+        isolated(make_tree, path, args.entries)
+
+    from plotter.backends import open_file
+
+    f = open_file(path, 'root')
+    binning = None if args.auto else (100, 0., 100.)
+
+    # read the file once, so that the first case is not the only one reading from disk
+    f.project('tree', [ ('b%i' % i, '', (100, 0., 100.)) for i in range(max(NBRANCHES)) ])
+
+    print('%i entries, binning %s, selection %r' % (args.entries, 'auto' if args.auto else binning, args.selection))
+    print('%9s %14s %14s %8s' % ('branches', 'Draw each (s)', 'one loop (s)', 'speedup'))
+
+    for n in NBRANCHES:
+        branches = [ ('b%i' % i, args.selection, binning) for i in range(n) ]
+
+        t_draw, _ = timed(lambda: [ f._project_draw('tree', *branch) for branch in branches ], repeat=args.repeat)
+        t_loop, _ = timed(f.project, 'tree', branches, repeat=args.repeat)
+
+        print('%9i %14.2f %14.2f %8.1f' % (n, t_draw, t_loop, t_draw / t_loop))
@@ -0,0 +1,70 @@
+# plotter
+# benchmarks/project_threads.py
+#
+# Scaling of the tree projections with the number of threads (--threads),
+# and check that the histograms match the single threaded ones bin for bin.
+#
+#   python benchmarks/project_threads.py [--entries 20000000] [--branches 8]
+
+import os
+import argparse
+
+import numpy as np
+
+from common import timed, isolated, data_path
+from project_branches import make_tree
+
+THREADS = (1, 2, 4, 8, 16)
+
+
+def max_difference(hists, reference):
+    """ Largest difference of the contents and squared weights, with under/overflow """
+
+    from plotter.arrays import get_cells
+
+    diff = 0.
+    for hist, ref in zip(hists, reference):
+        (values, sumw2), (ref_values, ref_sumw2) = get_cells(hist), get_cells(ref)
+        if len(values) != len(ref_values):
+            return float('inf')
+        diff = max(diff, np.abs(values - ref_values).max())
+        if sumw2 is not None and ref_sumw2 is not None:
+            diff = max(diff, np.abs(sumw2 - ref_sumw2).max())
+
+    return diff
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='thread scaling of the tree projections')
+    parser.add_argument('--entries', type=int, default=20000000)
+    parser.add_argument('--branches', type=int, default=8)
+    parser.add_argument('--selection', default='b1>20')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    path = data_path('tree_%i.root' % args.entries)
+    if not os.path.exists(path):
+        print('writing %s' % path)
+        isolated(make_tree, path, args.entries)
+
+    from plotter.backends import open_file, set_threads
+
+    f = open_file(path, 'root')
+    branches = [ ('b%i' % i, args.selection, (100, 0., 100.)) for i in range(args.branches) ]
+
+    print('%i entries, %i branches, selection %r, %i cores' % (args.entries, args.branches, args.selection, os.cpu_count()))
+    print('%8s %10s %8s %16s' % ('threads', 'time (s)', 'speedup', 'max bin diff'))
+
+    reference = None
+    for n in THREADS:
+        set_threads(n)
+
+        elapsed, hists = timed(f.project, 'tree', branches, repeat=args.repeat)
+
+        if reference is None:
+            reference, t_ref = hists, elapsed
+
+        print('%8i %10.2f %8.1f %16g' % (n, elapsed, t_ref / elapsed, max_difference(hists, reference)))
+
+    set_threads(1)
@@ -0,0 +1,96 @@
+# plotter
+# benchmarks/ratio_engine.py
+#
+# Ratio of 100 histograms of 10k bins to a reference: the numpy engine of
+# plotter.ratio on the bin arrays, ratio_graphs on TH1D (arrays read from
+# the histograms, TGraphErrors made), and a per-bin PyROOT loop. Each with
+# the same binning as the reference, and with half the bins (rebinned).
+#
+#   python benchmarks/ratio_engine.py [--hists 100] [--bins 10000]
+
+import argparse
+
+import numpy as np
+
+from common import timed
+
+from plotter.ratio import compute_ratio, ratio_graphs
+
+
+def make_arrays(nbins, rng):
+    """ (x low, x high, y, y error low, y error high) of a histogram on [0, 100) """
+    edges = np.linspace(0., 100., nbins + 1)
+    y = rng.poisson(1000., nbins).astype(np.float64)
+    err = np.sqrt(y)
+    return edges[:-1], edges[1:], y, err, err
+
+
+def make_hist(name, arrays, ROOT):
+    xl, xh, y, err, _ = arrays
+    hist = ROOT.TH1D(name, name, len(y), xl[0], xh[-1])
+    hist.SetDirectory(0)
+    hist.Sumw2()
+    hist.SetContent(np.concatenate(([0.], y, [0.])))
+    hist.SetError(np.concatenate(([0.], err, [0.])))
+    return hist
+
+
+def ratio_loop(ref, hists):
+    """ Per bin, through PyROOT, at the bin centers of the reference """
+
+    ratios = []
+    for hist in hists:
+        points = []
+        for i in range(1, ref.GetNbinsX() + 1):
+            x = ref.GetBinCenter(i)
+            r = ref.GetBinContent(i)
+            j = hist.FindBin(x)
+            # a coarser histogram is shared by the reference bins it covers
+            width = ref.GetBinWidth(i) / hist.GetBinWidth(j)
+            if r != 0:
+                points.append((x, hist.GetBinContent(j) * width / r, hist.GetBinError(j) * width / abs(r)))
+        ratios.append(points)
+
+    return ratios
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='time of the ratio computation')
+    parser.add_argument('--hists', type=int, default=100)
+    parser.add_argument('--bins', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+
+    ref = make_arrays(args.bins, rng)
+    cases = {
+        'same binning': [ make_arrays(args.bins, rng) for _ in range(args.hists) ],
+        'rebinned': [ make_arrays(args.bins // 2, rng) for _ in range(args.hists) ],
+    }
+
+    print('%i histograms of %i bins against a reference of %i bins' % (args.hists, args.bins, args.bins))
+    print('%-14s %-24s %10s' % ('', 'engine', 'time (s)'))
+
+    for label, arrays in cases.items():
+        elapsed, _ = timed(lambda: [ compute_ratio(ref, True, num, True) for num in arrays ], repeat=args.repeat)
+        print('%-14s %-24s %10.3f' % (label, 'numpy on arrays', elapsed))
+
+    try:
+        from plotter.backends import load_root
+        ROOT = load_root()
+    except ImportError:
+        print('ROOT not available, the TH1D cases are skipped')
+        raise SystemExit(0)
+
+    ref_hist = make_hist('ref', ref, ROOT)
+
+    for label, arrays in cases.items():
+        hists = [ make_hist('h%i' % i, a, ROOT) for i, a in enumerate(arrays) ]
+
+        elapsed, _ = timed(ratio_graphs, [ref_hist] + hists, repeat=args.repeat)
+        print('%-14s %-24s %10.3f' % (label, 'ratio_graphs on TH1D', elapsed))
+
+        elapsed, _ = timed(ratio_loop, ref_hist, hists)
+        print('%-14s %-24s %10.3f' % (label, 'per-bin PyROOT loop', elapsed))
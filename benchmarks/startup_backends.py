@@ -0,0 +1,108 @@
+# plotter
+# benchmarks/startup_backends.py
+#
+# Startup (import, open and list a file, in a new interpreter) and branch
+# projection times of the ROOT and uproot backends. The projected histograms
+# of the two backends are also compared bin for bin.
+#
+#   python benchmarks/startup_backends.py [--entries 5000000] [--branches 8] [--backends root uproot]
+
+import os
+import sys
+import argparse
+import subprocess
+
+import numpy as np
+
+from common import timed, isolated, data_path
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP = '''
+import sys
+sys.path.insert(0, %r)
+from plotter.backends import open_file
+f = open_file(%r, %r)
+n = sum(1 for _ in f)
+print(n, 'ROOT' in sys.modules)
+'''
+
+
+def make_tree(path, nentries, nbranches=20, chunk=1000000):
+    """ Written with uproot, readable by both backends """
+
+    import uproot
+
+    rng = np.random.default_rng(1)
+
+    with uproot.recreate(path) as f:
+        tree = f.mktree('tree', { 'b%i' % i: np.float64 for i in range(nbranches) })
+        for start in range(0, nentries, chunk):
+            n = min(chunk, nentries - start)
+            tree.extend({ 'b%i' % i: rng.uniform(0., 100., n) for i in range(nbranches) })
+
+
+def startup(backend, path, repeat):
+    """ (best wall time of a new interpreter listing the file, entries, ROOT imported) """
+
+    code = STARTUP % (REPO, path, backend)
+
+    def run():
+        return subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout.split()
+
+    elapsed, (n, root_loaded) = timed(run, repeat=repeat)
+
+    return elapsed, int(n), root_loaded == 'True'
+
+
+def cells(hist):
+
+    if hasattr(hist, 'sumw'):
+        return hist.sumw
+
+    from plotter.arrays import get_cells
+    return get_cells(hist)[0]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='startup and projection time of the file backends')
+    parser.add_argument('--entries', type=int, default=5000000)
+    parser.add_argument('--branches', type=int, default=8)
+    parser.add_argument('--selection', default='', help='valid for both backends, e.g. "b1 > 20"')
+    parser.add_argument('--backends', nargs='+', default=['root', 'uproot'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    path = data_path('uproot_tree_%i.root' % args.entries)
+    if not os.path.exists(path):
+        print('writing %s' % path)
+        isolated(make_tree, path, args.entries)
+
+    print('startup: import, open and list %s' % path)
+    print('%-8s %10s %8s %14s' % ('backend', 'time (s)', 'entries', 'ROOT imported'))
+    for backend in args.backends:
+        elapsed, n, root_loaded = startup(backend, path, args.repeat)
+        print('%-8s %10.2f %8i %14s' % (backend, elapsed, n, root_loaded))
+
+    from plotter.backends import open_file
+
+    branches = [ ('b%i' % i, args.selection, (100, 0., 100.)) for i in range(args.branches) ]
+
+    print('\nprojection of %i branches, %i entries, selection %r' % (args.branches, args.entries, args.selection))
+    print('%-8s %10s %16s' % ('backend', 'time (s)', 'max bin diff'))
+
+    reference = None
+    for backend in args.backends:
+        f = open_file(path, backend)
+
+        # the first read also loads the baskets into the page cache
+        f.project('tree', branches[:1])
+        elapsed, hists = timed(f.project, 'tree', branches, repeat=args.repeat)
+
+        hists = [ cells(hist) for hist in hists ]
+        if reference is None:
+            reference = hists
+
+        diff = max(np.abs(h - r).max() for h, r in zip(hists, reference))
+        print('%-8s %10.2f %16g' % (backend, elapsed, diff))
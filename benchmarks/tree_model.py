@@ -0,0 +1,98 @@
+# plotter
+# benchmarks/tree_model.py
+#
+# Time of a QAbstractItemModelTester walk (index/parent/rowCount/data of
+# every node, fetching the lazy ones) over a file tree of 100k nodes, with
+# the row kept in each TreeItem and with the row searched in the parent
+# (list.index, as before). parent() needs the row of the parent, so the
+# default tree has many directories side by side.
+#
+#   python benchmarks/tree_model.py [--dirs 20000] [--per-dir 4]
+
+import time
+import argparse
+
+from common import timed
+
+from PySide2.QtCore import QCoreApplication, QModelIndex
+from PySide2.QtTest import QAbstractItemModelTester
+
+from plotter.backends import FileBase
+from plotter.file_model import TreeModel, TreeItem
+
+
+class SyntheticFile(FileBase):
+    """ Listing of ndirs directories of per_dir histograms, no file is read """
+
+    def __init__(self, ndirs, per_dir):
+        self.ndirs = ndirs
+        self.per_dir = per_dir
+        super().__init__('synthetic.root')
+
+    def _open(self):
+        return True
+
+    def _read_uuid(self):
+        return 'synthetic'
+
+    def _list_entries(self, parent_name, parent_dtype):
+        if not parent_name:
+            return [ ('dir', 'dir%i' % i, 'dir%i' % i) for i in range(self.ndirs) ]
+        return [ ('hist', '%s/h%i' % (parent_name, i), 'h%i' % i) for i in range(self.per_dir) ]
+
+
+def tester_walk(ndirs, per_dir):
+    """ (walk fetching the lazy nodes, walk of the fetched model, number of nodes) """
+
+    model = TreeModel([], [])
+    model.addFile('synthetic.root', SyntheticFile(ndirs, per_dir))
+
+    mode = QAbstractItemModelTester.FailureReportingMode.Fatal
+
+    # the tester checks the whole model when created, and on each change
+    t_fetch, tester = timed(QAbstractItemModelTester, model, mode)
+    t_walk, tester = timed(QAbstractItemModelTester, model, mode)
+
+    return t_fetch, t_walk, model
+
+
+def parent_walk(model):
+    """ model.parent() of every node, what a view asks while scrolling """
+
+    indexes = []
+    def walk(parent):
+        for row in range(model.rowCount(parent)):
+            index = model.index(row, 0, parent)
+            indexes.append(index)
+            walk(index)
+    walk(QModelIndex())
+
+    start = time.perf_counter()
+    for index in indexes:
+        model.parent(index)
+
+    return time.perf_counter() - start, len(indexes)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='QAbstractItemModelTester walk of the file tree')
+    parser.add_argument('--dirs', type=int, default=20000)
+    parser.add_argument('--per-dir', type=int, default=4)
+    args = parser.parse_args()
+
+    app = QCoreApplication([])
+
+    cases = [ ('row kept in the item', TreeItem.childNumber),
+              ('list.index', lambda self: self.parent_item.child_items.index(self)) ]
+
+    print('%i directories of %i histograms' % (args.dirs, args.per_dir))
+    print('%-22s %8s %14s %14s %14s' % ('childNumber', 'nodes', 'fetch walk (s)', 'walk (s)', 'parent() (s)'))
+
+    for label, child_number in cases:
+        TreeItem.childNumber = child_number
+
+        t_fetch, t_walk, model = tester_walk(args.dirs, args.per_dir)
+        t_parent, nodes = parent_walk(model)
+
+        print('%-22s %8i %14.2f %14.2f %14.2f' % (label, nodes, t_fetch, t_walk, t_parent))
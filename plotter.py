@@ -1,11 +1,76 @@
 import sys
+import argparse
 
-from PySide2.QtWidgets import QApplication
-
-from plotter.mainwindow import MainWindow
+from plotter.startup import StartupProfile
 
 if __name__ == '__main__':
+
+    # before any other import, for --profile-startup. Only in the main
+    # process, the batch workers import this module too
+    profile = StartupProfile()
+    profile.install()
+
+    from plotter.cache import IndexCache, ProjectionCache, DiskCache
+    from plotter.backends import BACKENDS
+
+    parser = argparse.ArgumentParser(description='plotter')
+    parser.add_argument('files', nargs='*', help='ROOT files')
+    parser.add_argument('--batch', metavar='SPEC', help='render the plots of a json specification without a display')
+    parser.add_argument('--output-dir', default='.', help='output directory for --batch')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of processes for --batch (default: number of cores)')
+    parser.add_argument('--backend', choices=BACKENDS, default='root', help='library used to read the files (uproot: numpy projections, python selections)')
+    parser.add_argument('--threads', type=int, default=1, help='number of threads for the tree projections')
+    parser.add_argument('--projection-cache', type=int, default=256, metavar='MB', help='memory budget for the projected histograms (0 to disable)')
+    parser.add_argument('--disk-cache', type=int, default=2048, metavar='MB', help='size of the on-disk cache of projected histograms (0 to disable)')
+    parser.add_argument('--cache-info', action='store_true', help='show the on-disk projection cache usage and exit')
+    parser.add_argument('--purge-cache', action='store_true', help='remove all the projected histograms from the on-disk cache and exit')
+    parser.add_argument('--max-canvases', type=int, default=10, help='maximum number of open canvases, the oldest one is reused')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the file index cache')
+    parser.add_argument('--rebuild-cache', action='store_true', help='ignore and rebuild the file index cache')
+    parser.add_argument('--profile-startup', action='store_true', help='print the time spent in each import and startup step on exit')
+
+    args = parser.parse_args()
+
+    if not args.profile_startup:
+        profile.uninstall()
+
+    if args.cache_info or args.purge_cache:
+        disk_cache = DiskCache()
+
+        if args.purge_cache:
+            disk_cache.purge()
+
+        nentries, nbytes = disk_cache.info()
+        print('%s: %i histograms, %.1f MB' % (disk_cache.cache_dir, nentries, nbytes/1024/1024))
+        sys.exit(0)
+
+    if args.batch:
+        from plotter.batch import run_batch
+        sys.exit(run_batch(args.batch, args.output_dir, args.jobs, args.disk_cache*1024*1024, args.threads, args.backend))
+
+    index_cache = None if args.no_cache else IndexCache(rebuild=args.rebuild_cache)
+
+    disk_cache = DiskCache(max_bytes=args.disk_cache*1024*1024) if args.disk_cache > 0 else None
+    projection_cache = ProjectionCache(args.projection_cache*1024*1024, disk_cache)
+
+    profile.mark('arguments parsed')
+
+    from PySide2.QtCore import QTimer
+    from PySide2.QtWidgets import QApplication
+    from plotter.mainwindow import MainWindow
+
+    profile.mark('modules imported')
+
     app = QApplication()
-    window = MainWindow(None, sys.argv[1:])
+    window = MainWindow(None, args.files, index_cache, args.threads, projection_cache, args.max_canvases, args.backend)
     window.show()
-    sys.exit(app.exec_())
+
+    profile.mark('window created')
+    QTimer.singleShot(0, lambda: profile.mark('window shown'))
+
+    status = app.exec_()
+
+    if args.profile_startup:
+        profile.report()
+
+    sys.exit(status)
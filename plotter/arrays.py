@@ -0,0 +1,107 @@
+# plotter
+# arrays.py
+#
+# numpy views of the contents of 1D histograms and graphs, read through the
+# buffers returned by GetArray()/GetX()/... without copying or a python call
+# per bin.
+
+import numpy as np
+
+
+# TH1 array type (last letter of the class name) -> numpy dtype
+_dtypes = {'C': np.int8, 'S': np.int16, 'I': np.int32, 'F': np.float32, 'D': np.float64, 'L': np.int64}
+
+
+def view(buf, n, dtype=np.float64):
+    """ numpy array over a C array of n elements """
+
+    if n == 0:
+        return np.empty(0, dtype)
+
+    # the views returned by PyROOT have no size until reshaped
+    buf.reshape((n,))
+
+    return np.frombuffer(buf, dtype, n)
+
+
+def _hist_arrays(hist):
+
+    nbins = hist.GetNbinsX()
+
+    axis = hist.GetXaxis()
+    if axis.GetXbins().GetSize():
+        edges = view(axis.GetXbins().GetArray(), nbins + 1)
+    else:
+        edges = np.linspace(axis.GetXmin(), axis.GetXmax(), nbins + 1)
+
+    dtype = _dtypes.get(hist.ClassName()[-1])
+
+    # profiles store sums, not the values drawn
+    if dtype is None or hist.InheritsFrom('TProfile'):
+        y = np.fromiter((hist.GetBinContent(i) for i in range(1, nbins + 1)), np.float64, nbins)
+        err = np.fromiter((hist.GetBinError(i) for i in range(1, nbins + 1)), np.float64, nbins)
+        return edges[:-1], edges[1:], y, err, err
+
+    # without under/overflow
+    y = view(hist.GetArray(), nbins + 2, dtype)[1:-1]
+
+    if hist.GetSumw2N():
+        err = np.sqrt(view(hist.GetSumw2().GetArray(), nbins + 2)[1:-1])
+    else:
+        err = np.sqrt(np.abs(y))
+
+    return edges[:-1], edges[1:], y, err, err
+
+
+def _graph_arrays(graph):
+
+    n = graph.GetN()
+
+    x = view(graph.GetX(), n)
+    y = view(graph.GetY(), n)
+
+    if graph.InheritsFrom('TGraphAsymmErrors'):
+        exl, exh = view(graph.GetEXlow(), n), view(graph.GetEXhigh(), n)
+        eyl, eyh = view(graph.GetEYlow(), n), view(graph.GetEYhigh(), n)
+    elif graph.InheritsFrom('TGraphErrors'):
+        exl = exh = view(graph.GetEX(), n)
+        eyl = eyh = view(graph.GetEY(), n)
+    else:
+        exl = exh = eyl = eyh = np.zeros(n)
+
+    return x - exl, x + exh, y, eyl, eyh
+
+
+def get_arrays(obj):
+    """
+    (x low, x high, y, y error low, y error high) of the bins of a 1D histogram
+    or the points of a graph, None for other objects. The histogram contents
+    are views of the object, valid while it is alive.
+    """
+
+    if obj.InheritsFrom('TH1'):
+        if obj.GetDimension() != 1:
+            return None
+        return _hist_arrays(obj)
+
+    if obj.InheritsFrom('TGraph'):
+        return _graph_arrays(obj)
+
+    return None
+
+
+def get_cells(hist):
+    """
+    Views of all the cells of a histogram, with under/overflow, and of its sum
+    of squared weights (None if not stored). None if the array type is unknown.
+    """
+
+    dtype = _dtypes.get(hist.ClassName()[-1])
+    if dtype is None or not hist.InheritsFrom('TH1') or hist.InheritsFrom('TProfile'):
+        return None
+
+    ncells = hist.GetNcells()
+
+    sumw2 = view(hist.GetSumw2().GetArray(), ncells) if hist.GetSumw2N() else None
+
+    return view(hist.GetArray(), ncells, dtype), sumw2
@@ -0,0 +1,429 @@
+# plotter
+# backends.py
+#
+# Files are read either with PyROOT (plotter.rootfile) or with uproot and
+# numpy (plotter.uprootfile). Both share the listing, caching and request
+# grouping logic of FileBase. The backend modules are only imported when
+# a file is opened, and ROOT itself is loaded with load_root(), in the
+# background by the GUI or on first use.
+
+import sys
+import threading
+
+BACKENDS = ('root', 'uproot')
+
+# tree entries read at a time by the streaming projections
+CHUNK_ENTRIES = 100000
+
+# approximate tree entries read by the preview projections
+PREVIEW_ENTRIES = 1000000
+
+_root_lock = threading.Lock()
+_root = None
+
+
+def load_root():
+    """ Import and set up ROOT, safe to call from any thread """
+
+    global _root
+
+    # also called from the functions using ROOT, only lock the first time
+    if _root is None:
+        with _root_lock:
+            if _root is None:
+                import ROOT
+
+                # the first access also finishes the PyROOT setup, keep it under the lock
+                ROOT.ROOT.EnableThreadSafety()
+
+                _root = ROOT
+
+    return _root
+
+
+def open_file(path, backend='root', index_cache=None, projection_cache=None):
+
+    if backend == 'uproot':
+        from plotter.uprootfile import UprootFile
+        return UprootFile(path, index_cache, projection_cache)
+
+    elif backend == 'root':
+        from plotter.rootfile import RootFile
+        return RootFile(path, index_cache, projection_cache)
+
+    raise ValueError('unknown backend: %s' % backend)
+
+
+def set_threads(n):
+    """ Number of threads for the projections, only relevant if ROOT is used """
+    if 'plotter.rootfile' in sys.modules:
+        sys.modules['plotter.rootfile'].set_threads(n)
+
+
+def to_root(obj):
+    """ ROOT object to draw, the uproot backend returns objects converted on demand """
+    if obj is not None and hasattr(obj, 'to_root'):
+        return obj.to_root()
+    return obj
+
+
+def copy_object(obj):
+    """ Copy of an object for drawing, while the original keeps being filled """
+
+    if obj is None or hasattr(obj, 'to_root'):
+        return to_root(obj)
+
+    obj = obj.Clone()
+    if obj.InheritsFrom('TH1'):
+        obj.SetDirectory(0)
+
+    return obj
+
+
+class FileBase:
+    """
+    Common part of the file backends. Subclasses implement:
+
+      _open()                      open the file, return a handle
+      _read_uuid()                 UUID of the open file as a string
+      _list_entries(parent, dtype) direct children of a dir/tree as (dtype, path, name)
+      read_object(path)            read a histogram/graph, None if missing
+      project(treename, branches)  project a list of (name, selection, binning)
+      project_ranges(treename, branches, ranges)
+                                   the same for a list of entry ranges (start, stop),
+                                   yields (entries done, hists) after each range
+      tree_entries(treename)       number of entries, 0 if missing
+      tree_clusters(treename)      entry ranges (start, stop) of the clusters
+
+    project() is called without the file lock (self._lock), so that listing
+    the file is not held up by a long event loop: it takes the lock itself
+    around the reads of the open file. The other methods are called with it.
+    """
+
+    # projections are also kept in the disk cache
+    use_disk_cache = True
+
+    def __init__(self, path, index_cache=None, projection_cache=None):
+        self.path = path
+        self.name = path.replace(".root", "").split('/')[-1]
+        self.index_cache = index_cache
+        self.projection_cache = projection_cache
+
+        self._handle = None
+        self._uuid = None
+
+        # the file is read from the GUI, loader and draw threads
+        self._lock = threading.RLock()
+
+        # parent path -> [(dtype, path, name), ...]
+        self._listing = {}
+
+        # listings not stored in the index cache yet, during a walk (__iter__)
+        self._unstored = None
+
+        if index_cache is not None:
+            cached = index_cache.load(path)
+            if cached is not None:
+                self._uuid, self._listing = cached
+
+        # with a cached listing the file is only opened when needed
+        if not self._listing:
+            self._handle = self._open()
+
+    @property
+    def _file(self):
+        with self._lock:
+            if self._handle is None:
+                self._handle = self._open()
+
+                # the file was rewritten keeping size and mtime: drop the cached listing
+                if self._handle and self._uuid is not None and self._read_uuid() != self._uuid:
+                    self._uuid = None
+                    self._listing = {}
+                    self.index_cache.invalidate(self.path)
+
+            return self._handle
+
+    @property
+    def uuid(self):
+        if self._uuid is None:
+            self._file
+            self._uuid = self._read_uuid()
+        return self._uuid
+
+    def __iter__(self):
+
+        # the listings of a whole walk go to the index cache in one transaction
+        with self._lock:
+            owner = self._unstored is None
+            if owner:
+                self._unstored = {}
+
+        try:
+            for depth, dtype, path, name in self.browse_dir(0, ''):
+                yield (depth, dtype, path, name)
+
+        finally:
+            if owner:
+                with self._lock:
+                    unstored, self._unstored = self._unstored, None
+
+                if unstored and self.index_cache is not None:
+                    self.index_cache.store(self.path, self.uuid, unstored)
+
+    def is_valid(self):
+        if self._handle is None:
+            return bool(self._listing)
+        return bool(self._handle)
+
+    def list_dir(self, parent_name='', parent_dtype='dir'):
+        """ List the direct children of a directory or tree as (dtype, path, name) """
+
+        if parent_name in self._listing:
+            return self._listing[parent_name]
+
+        with self._lock:
+            if parent_name in self._listing:
+                return self._listing[parent_name]
+
+            entries = self._list_entries(parent_name, parent_dtype)
+
+            self._listing[parent_name] = entries
+
+            if self.index_cache is None:
+                return entries
+
+            if self._unstored is not None:
+                self._unstored[parent_name] = entries
+                return entries
+
+            uuid = self.uuid
+
+        self.index_cache.store(self.path, uuid, {parent_name: entries})
+
+        return entries
+
+    def browse_dir(self, depth, parent_name, parent_dtype='dir'):
+
+        for dtype, path, name in self.list_dir(parent_name, parent_dtype):
+
+            yield (depth, dtype, path, name)
+
+            if dtype in ('dir', 'tree'):
+                for ddepth, ddtype, dpath, dname in self.browse_dir(depth+1, path, dtype):
+                    yield (ddepth, ddtype, dpath, dname)
+
+    def get_object_info(self, path):
+        pass
+
+    def has_object(self, path):
+
+        if '//' in path:
+            parent, dtype = path.rpartition('//')[0], 'tree'
+        else:
+            parent, dtype = path.rpartition('/')[0], 'dir'
+
+        if parent and not self.has_object(parent):
+            return False
+
+        return any(epath == path for _, epath, _ in self.list_dir(parent, dtype))
+
+    def get_object(self, path, selection='', binning=None):
+        return self.get_objects([(path, selection, binning)])[0]
+
+    def get_objects(self, requests, sample_entries=None):
+        """
+        Get the objects for a list of (path, selection, binning). All the branches
+        requested from the same tree are projected in a single event loop.
+        Binning is (nbins, xmin, xmax), or None for automatic binning.
+
+        With sample_entries, trees with more entries are only projected on a
+        sample of about that size (see sample_ranges) and the histograms are
+        scaled to the total number of entries.
+
+        The returned objects are new, detached from any directory and owned by
+        the caller, who can modify them (e.g. set_style) without copying.
+        Missing objects are returned as None.
+        """
+
+        print('get_objects', requests)
+
+        with self._lock:
+            objects, trees = self._prepare(requests, sample_entries)
+
+        for treename, branches in trees.items():
+
+            branches_args = [ (name, selection, binning) for _, name, selection, binning in branches ]
+
+            with self._lock:
+                ranges = self.sample_ranges(treename, sample_entries) if sample_entries else None
+
+            if ranges is None:
+                hists = self.project(treename, branches_args)
+            else:
+                # files are sampled concurrently: project_ranges must not share
+                # histograms between calls (see RootFile._draw)
+                with self._lock:
+                    for _, hists in self.project_ranges(treename, branches_args, ranges):
+                        pass
+
+                    # as if the whole tree was read
+                    scale = self.tree_entries(treename) / sum(stop - start for start, stop in ranges)
+
+                for hist in hists:
+                    if hist is not None:
+                        hist.Scale(scale)
+
+            for (i, name, selection, binning), hist in zip(branches, hists):
+                objects[i] = hist
+
+            with self._lock:
+                self._cache_projections(treename, branches, hists, sample_entries if ranges else None)
+
+        return objects
+
+    def sample_ranges(self, treename, sample_entries):
+        """
+        Entry ranges of a deterministic sample of about sample_entries entries:
+        every k-th cluster, or the first entries if the tree has too few
+        clusters. None if the tree is small enough to be read entirely.
+        """
+
+        nentries = self.tree_entries(treename)
+        if nentries <= sample_entries:
+            return None
+
+        clusters = self.tree_clusters(treename)
+
+        step = -(-nentries // sample_entries)
+        if len(clusters) >= 2 * step:
+            return clusters[::step]
+
+        return [(0, sample_entries)]
+
+    def sampled_fraction(self, path, sample_entries):
+        """ Fraction of the entries of the tree of a branch read with sample_entries, 1 for the whole tree """
+
+        if '//' not in path:
+            return 1.
+
+        treename = path.split(':')[-1].split('//')[0]
+
+        with self._lock:
+            ranges = self.sample_ranges(treename, sample_entries)
+            if ranges is None:
+                return 1.
+
+            return sum(stop - start for start, stop in ranges) / self.tree_entries(treename)
+
+    def _prepare(self, requests, sample_entries=None):
+        """
+        Read the histograms/graphs and the cached projections. Returns the
+        objects and, per tree, the (index, name, selection, binning) still to project
+        """
+
+        objects = [None] * len(requests)
+
+        trees = {}
+        for i, (path, selection, binning) in enumerate(requests):
+
+            if ':' in path:
+                _, path = path.split(':')
+
+            # tree
+            if '//' in path:
+                treename, name = path.split('//')
+                trees.setdefault(treename, []).append((i, name, selection, binning))
+
+            else:
+                # histogram/graph, possibly inside dir
+                objects[i] = self.read_object(path)
+
+        # reuse cached projections, only the missing ones go through the tree
+        if self.projection_cache is not None:
+            for treename in list(trees):
+                missing = []
+                for i, name, selection, binning in trees[treename]:
+                    objects[i] = self.projection_cache.get(self._cache_key(treename, name, selection, binning, sample_entries), self.use_disk_cache)
+                    if objects[i] is None:
+                        missing.append((i, name, selection, binning))
+
+                if missing:
+                    trees[treename] = missing
+                else:
+                    del trees[treename]
+
+        return objects, trees
+
+    def _cache_key(self, treename, name, selection, binning, sample_entries=None):
+        if sample_entries is None:
+            return (self.uuid, treename, name, selection, binning)
+        return (self.uuid, treename, name, selection, binning, 'sample', sample_entries)
+
+    def _cache_projections(self, treename, branches, hists, sample_entries=None):
+
+        if self.projection_cache is None:
+            return
+
+        for (i, name, selection, binning), hist in zip(branches, hists):
+            if hist is not None:
+                self.projection_cache.put(self._cache_key(treename, name, selection, binning, sample_entries), hist, self.use_disk_cache)
+
+    def cache_projection(self, path, selection, binning, hist, sample_entries=None):
+        """ Cache a projection of get_objects under another binning, e.g. the one its automatic binning gave """
+
+        if ':' in path:
+            _, path = path.split(':')
+
+        if '//' not in path or hist is None:
+            return
+
+        treename, name = path.split('//')
+
+        with self._lock:
+            self._cache_projections(treename, [(None, name, selection, binning)], [hist], sample_entries)
+
+    def iter_objects(self, requests, chunk_entries=CHUNK_ENTRIES):
+        """
+        Like get_objects, but the trees are projected chunk_entries entries at a
+        time. Yields (fraction done, objects) after each chunk, with the partial
+        histograms so far. These keep being filled by the next chunks: copy them
+        (copy_object) to keep a snapshot. Automatic binning is taken from the
+        first chunk.
+        """
+
+        with self._lock:
+            objects, trees = self._prepare(requests)
+
+        if not trees:
+            yield 1., objects
+            return
+
+        for itree, (treename, branches) in enumerate(trees.items()):
+
+            with self._lock:
+                nentries = self.tree_entries(treename)
+
+            ranges = [ (start, min(start + chunk_entries, nentries)) for start in range(0, nentries, chunk_entries) ]
+
+            chunks = self.project_ranges(treename, [ (name, selection, binning) for _, name, selection, binning in branches ], ranges)
+
+            # the file is only locked while reading a chunk
+            while True:
+                with self._lock:
+                    step = next(chunks, None)
+
+                if step is None:
+                    break
+
+                done, hists = step
+
+                for (i, _, _, _), hist in zip(branches, hists):
+                    objects[i] = hist
+
+                yield (itree + done / nentries) / len(trees), objects
+
+            # only complete projections are cached, and not the ones binned from the first chunk
+            branches = [ branch for branch in branches if branch[3] is not None ]
+            with self._lock:
+                self._cache_projections(treename, branches, [ objects[i] for i, _, _, _ in branches ])
@@ -0,0 +1,158 @@
+# plotter
+# batch.py
+#
+# Render plots without a display from a json specification:
+#
+# {
+#   "formats": ["pdf", "png"],
+#   "plots": [
+#     {
+#       "name": "met_et",
+#       "logx": false, "logy": true, "ratio": false, "stack": false,
+#       "items": [
+#         {"file": "data.root", "path": "cutflow/met_et"},
+#         {"file": "mc.root", "path": "tree//met_et", "colour": "red",
+#          "options": "hist same", "selection": "ph_n>0", "binning": [50, 0, 500]}
+#       ]
+#     }
+#   ]
+# }
+#
+# ROOT is only imported in the worker processes.
+
+import os
+import json
+import time
+import multiprocessing
+
+
+# per process state
+_files = {}
+_projection_cache = None
+_backend = 'root'
+
+
+def _init_worker(disk_cache_bytes, threads, backend):
+
+    global _projection_cache, _backend
+
+    from plotter.backends import load_root, set_threads
+
+    ROOT = load_root()
+    ROOT.gROOT.SetBatch(True)
+    from plotter.cache import ProjectionCache, DiskCache
+
+    _backend = backend
+
+    # set_threads only applies to an imported backend, the files are opened later
+    if backend == 'root':
+        import plotter.rootfile
+
+    set_threads(threads)
+
+    disk_cache = DiskCache(max_bytes=disk_cache_bytes) if disk_cache_bytes > 0 else None
+    _projection_cache = ProjectionCache(0, disk_cache)
+
+
+def _get_file(path):
+
+    from plotter.backends import open_file
+
+    if path not in _files:
+        _files[path] = open_file(path, _backend, None, _projection_cache)
+
+    return _files[path]
+
+
+def render_plot(args):
+    """ Create and save one plot, returns (name, error) """
+
+    iplot, conf, output_dir, formats = args
+
+    from plotter.plot import Plot
+    from plotter.backends import to_root
+    from plotter.style import default_colours
+
+    name = conf.get('name', 'plot_%d' % iplot).replace('/', '_')
+
+    try:
+        items = conf['items']
+
+        # objects of the same file are fetched together
+        requests = {}
+        for i, item in enumerate(items):
+            binning = item.get('binning')
+            request = (item['path'], item.get('selection', ''), tuple(binning) if binning else None)
+            requests.setdefault(item['file'], []).append((i, request))
+
+        objects = [None] * len(items)
+        for path, file_requests in requests.items():
+            file_objects = _get_file(path).get_objects([ request for _, request in file_requests ])
+            for (i, _), obj in zip(file_requests, file_objects):
+                objects[i] = obj
+
+        plot = Plot(name)
+
+        for i, (item, obj) in enumerate(zip(items, objects)):
+            if obj is None:
+                return (name, 'missing %s:%s' % (item['file'], item['path']))
+
+            colour = item.get('colour', default_colours[i % len(default_colours)])
+            opts = item.get('options', '' if i == 0 else 'same')
+
+            plot.add(to_root(obj), colour, [opts], item.get('label', ''))
+
+        plot.set_logx(conf.get('logx', False))
+        plot.set_logy(conf.get('logy', False))
+        plot.set_stack(conf.get('stack', False))
+
+        plot.create(do_ratio=conf.get('ratio', False))
+
+        try:
+            for extension in formats:
+                plot.save(extension, output_dir)
+        finally:
+            plot.close_canvas()
+
+    except Exception as e:
+        return (name, str(e))
+
+    return (name, None)
+
+
+def run_batch(spec_path, output_dir='.', jobs=None, disk_cache_bytes=0, threads=1, backend='root'):
+
+    with open(spec_path) as f:
+        spec = json.load(f)
+
+    plots = spec['plots']
+    formats = spec.get('formats', ['pdf'])
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    if jobs is None:
+        jobs = os.cpu_count()
+
+    tasks = [ (i, conf, output_dir, formats) for i, conf in enumerate(plots) ]
+
+    start = time.time()
+
+    # spawn: the workers must not inherit a half initialized ROOT
+    ctx = multiprocessing.get_context('spawn')
+
+    errors = []
+    with ctx.Pool(jobs, _init_worker, (disk_cache_bytes, threads, backend)) as pool:
+        for n, (name, error) in enumerate(pool.imap_unordered(render_plot, tasks), 1):
+            if error is not None:
+                errors.append((name, error))
+                print('[%i/%i] %s: ERROR %s' % (n, len(tasks), name, error))
+            else:
+                print('[%i/%i] %s' % (n, len(tasks), name))
+
+    elapsed = time.time() - start
+    ndone = len(tasks) - len(errors)
+
+    print('%i plots (%i files) in %.1f s: %.2f plots/s, %i errors' %
+          (ndone, ndone * len(formats), elapsed, ndone / elapsed if elapsed > 0 else 0, len(errors)))
+
+    return 1 if errors else 0
@@ -0,0 +1,344 @@
+# plotter
+# cache.py
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+
+from plotter.backends import load_root
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'plotter-qt')
+
+
+class IndexCache:
+    """
+    On-disk cache of the file listings (depth, dtype, path, name), keyed by
+    the absolute path, size, mtime and UUID of each file.
+    """
+
+    def __init__(self, db_path=None, max_bytes=64*1024*1024, rebuild=False):
+
+        if db_path is None:
+            db_path = os.path.join(CACHE_DIR, 'index.db')
+
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.rebuild = rebuild
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS files '
+                         '(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, uuid TEXT, nbytes INTEGER, atime REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                         '(file TEXT, parent TEXT, depth INTEGER, dtype TEXT, path TEXT, name TEXT)')
+            # also used for the lookups by file only
+            conn.execute('DROP INDEX IF EXISTS entries_file')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_parent ON entries (file, parent)')
+
+    def _connect(self):
+        # one connection per call, the cache is used from the loader threads
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def _stat(path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+
+    def load(self, path):
+        """ Return (uuid, {parent: [(dtype, path, name), ...]}) or None if not cached or stale """
+
+        path = os.path.abspath(path)
+
+        try:
+            size, mtime = self._stat(path)
+        except OSError:
+            return None
+
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute('SELECT size, mtime, uuid FROM files WHERE path=?', (path,)).fetchone()
+            if row is None:
+                return None
+
+            if self.rebuild or row[0] != size or row[1] != mtime:
+                self._delete(conn, path)
+                return None
+
+            conn.execute('UPDATE files SET atime=? WHERE path=?', (time.time(), path))
+
+            listing = {}
+            for parent, dtype, epath, name in conn.execute(
+                    'SELECT parent, dtype, path, name FROM entries WHERE file=? ORDER BY rowid', (path,)):
+                listing.setdefault(parent, []).append((dtype, epath, name))
+
+        return row[2], listing
+
+    def store(self, path, uuid, listings):
+        """ Add the listings {parent: [(dtype, path, name), ...]} of directories/trees of a file """
+
+        path = os.path.abspath(path)
+
+        try:
+            size, mtime = self._stat(path)
+        except OSError:
+            return
+
+        rows = []
+        nbytes = 0
+        for parent, entries in listings.items():
+            for dtype, epath, name in entries:
+                depth = epath.replace('//', '/').count('/')
+                rows.append((path, parent, depth, dtype, epath, name))
+                nbytes += len(parent) + len(dtype) + len(epath) + len(name) + 8
+
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute('SELECT size, mtime, uuid FROM files WHERE path=?', (path,)).fetchone()
+
+            if row is not None and (row[0] != size or row[1] != mtime or row[2] != uuid):
+                self._delete(conn, path)
+                row = None
+
+            if row is None:
+                conn.execute('INSERT INTO files VALUES (?, ?, ?, ?, 0, ?)', (path, size, mtime, uuid, time.time()))
+
+            # a parent stored again replaces its old rows, and their size
+            for parent in listings:
+                old = conn.execute('SELECT COALESCE(SUM(LENGTH(parent) + LENGTH(dtype) + LENGTH(path) + LENGTH(name) + 8), 0) '
+                                   'FROM entries WHERE file=? AND parent=?', (path, parent)).fetchone()[0]
+                if old:
+                    conn.execute('DELETE FROM entries WHERE file=? AND parent=?', (path, parent))
+                    nbytes -= old
+
+            conn.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('UPDATE files SET nbytes=nbytes+?, atime=? WHERE path=?', (nbytes, time.time(), path))
+
+            self._evict(conn)
+
+    def invalidate(self, path):
+        with closing(self._connect()) as conn, conn:
+            self._delete(conn, os.path.abspath(path))
+
+    def clear(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM files')
+
+    def _delete(self, conn, path):
+        conn.execute('DELETE FROM entries WHERE file=?', (path,))
+        conn.execute('DELETE FROM files WHERE path=?', (path,))
+
+    def _evict(self, conn):
+        """ Drop the least recently used files until the cache fits in max_bytes """
+
+        total = conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM files').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for path, nbytes in conn.execute('SELECT path, nbytes FROM files ORDER BY atime').fetchall():
+            self._delete(conn, path)
+            total -= nbytes
+            if total <= self.max_bytes:
+                break
+
+
+# bytes per bin for the TH1 array types
+_bin_sizes = {'C': 1, 'S': 2, 'I': 4, 'F': 4, 'D': 8, 'L': 8}
+
+def hist_nbytes(hist):
+    """ Approximate memory used by the bin arrays of a histogram """
+    ncells = hist.GetNcells()
+    nbytes = ncells * _bin_sizes.get(hist.ClassName()[-1], 8)
+    if hist.GetSumw2N():
+        nbytes += ncells * 8
+    return nbytes
+
+
+class ProjectionCache:
+    """
+    In-memory LRU cache of projected histograms, keyed by
+    (file uuid, tree, expression, selection, ...) and bounded by max_bytes.
+
+    The cache keeps its own copy of each histogram and get() returns a new
+    copy, so objects styled or modified by the caller never come back.
+    Misses are looked up in the optional disk cache, unless disk=False
+    (objects that are not ROOT histograms).
+    """
+
+    def __init__(self, max_bytes=256*1024*1024, disk_cache=None):
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.disk_cache = disk_cache
+
+        self._hists = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hists)
+
+    @staticmethod
+    def _copy(hist):
+        hist = hist.Clone()
+        hist.SetDirectory(0)
+        return hist
+
+    def get(self, key, disk=True):
+
+        with self._lock:
+            entry = self._hists.get(key)
+            if entry is not None:
+                self._hists.move_to_end(key)
+                return self._copy(entry[0])
+
+        if self.disk_cache is None or not disk:
+            return None
+
+        hist = self.disk_cache.get(key)
+        if hist is not None:
+            self._put_memory(key, hist)
+
+        return hist
+
+    def put(self, key, hist, disk=True):
+
+        if self.disk_cache is not None and disk:
+            self.disk_cache.put(key, hist)
+
+        self._put_memory(key, hist)
+
+    def _put_memory(self, key, hist):
+
+        nbytes = hist_nbytes(hist)
+        if nbytes > self.max_bytes:
+            return
+
+        hist = self._copy(hist)
+
+        with self._lock:
+            if key in self._hists:
+                self.nbytes -= self._hists.pop(key)[1]
+
+            self._hists[key] = (hist, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, (_, old_nbytes) = self._hists.popitem(last=False)
+                self.nbytes -= old_nbytes
+
+    def clear(self):
+        with self._lock:
+            self._hists.clear()
+            self.nbytes = 0
+
+
+class DiskCache:
+    """
+    Projected histograms saved across sessions, one ROOT file per entry
+    named by the hash of the key. Entries are evicted by last access once
+    the total size exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=2*1024*1024*1024):
+
+        if cache_dir is None:
+            cache_dir = os.path.join(CACHE_DIR, 'projections')
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.root')
+
+    def _entries(self):
+        """ List of (mtime, size, path), the mtime is refreshed on each access """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.root'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def get(self, key):
+
+        ROOT = load_root()
+
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+
+        f = ROOT.TFile.Open(path)
+        if not f or f.IsZombie():
+            return None
+
+        hist = f.Get('h')
+        if hist:
+            hist.SetDirectory(0)
+        f.Close()
+
+        if not hist:
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return hist
+
+    def put(self, key, hist):
+
+        ROOT = load_root()
+
+        path = self._path(key)
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+
+        f = ROOT.TFile.Open(tmp_path, 'RECREATE')
+        if not f or f.IsZombie():
+            return
+        f.WriteTObject(hist, 'h')
+        f.Close()
+
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.evict()
+
+    def evict(self):
+
+        entries = sorted(self._entries())
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def info(self):
+        """ Return (number of entries, total size in bytes) """
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    def purge(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
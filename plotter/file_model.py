@@ -1,15 +1,33 @@
-from PySide2.QtCore import QModelIndex, Qt, QAbstractItemModel, Signal
+import sys
+
+from PySide2.QtCore import QModelIndex, Qt, QAbstractItemModel, QSortFilterProxyModel, Signal
+
+
+# item types, stored as the index in this tuple
+DTYPES = ('root', 'file', 'dir', 'tree', 'branch', 'hist', 'graph')
+DTYPE_IDS = { dtype: i for i, dtype in enumerate(DTYPES) }
+
+ITEM_ROOT, ITEM_FILE, ITEM_DIR, ITEM_TREE = range(4)
+
+HEADERS = ['name', 'ifile', 'dtype', 'path']
 
-from plotter.rootfile import RootFile
 
 class TreeItem:
-    def __init__(self, data: list, parent: 'TreeItem' = None):
-        self.item_data = data
+
+    __slots__ = ('name', 'dtype', 'parent_item', 'child_items', 'fetched', 'row')
+
+    def __init__(self, name: str = None, dtype: int = ITEM_ROOT, parent: 'TreeItem' = None):
+        self.name = sys.intern(name) if name else name
+        self.dtype = dtype
         self.parent_item = parent
-        self.child_items = []
+        self.child_items = None
+        self.fetched = False
+
+        # position in the parent, kept up to date on insert/remove
+        self.row = 0
 
     def child(self, number: int) -> 'TreeItem':
-        if number < 0 or number >= len(self.child_items):
+        if number < 0 or number >= self.childCount():
             return None
         return self.child_items[number]
 
@@ -17,86 +35,103 @@ class TreeItem:
         return self.child_items[-1] if self.child_items else None
 
     def childCount(self) -> int:
-        return len(self.child_items)
+        return len(self.child_items) if self.child_items else 0
 
     def childNumber(self) -> int:
-        if self.parent_item:
-            return self.parent_item.child_items.index(self)
-        return 0
+        return self.row
+
+    def _renumber(self, position):
+        for row in range(position, len(self.child_items)):
+            self.child_items[row].row = row
 
     def columnCount(self) -> int:
-        return len(self.item_data)
+        return len(HEADERS)
+
+    @property
+    def ifile(self):
+        item = self
+        while item.dtype != ITEM_FILE:
+            item = item.parent_item
+        return item.ifile
+
+    @property
+    def path(self):
+        """ Rebuilt from the parent chain: dir/name, tree//branch """
+        parent = self.parent_item
+        if parent.dtype in (ITEM_ROOT, ITEM_FILE):
+            return self.name
+        elif parent.dtype == ITEM_TREE:
+            return parent.path + '//' + self.name
+        else:
+            return parent.path + '/' + self.name
+
+    @property
+    def item_data(self):
+        return [ self.data(column) for column in range(len(HEADERS)) ]
 
     def data(self, column: int):
-        if column < 0 or column >= len(self.item_data):
+        if column < 0 or column >= len(HEADERS):
             return None
-        return self.item_data[column]
-
-    def insertChildren(self, position, count, columns):
-        if position < 0 or position > len(self.child_items):
-            return False
-
-        for row in range(count):
-            data = [None] * columns
-            item = TreeItem(data.copy(), self)
-            self.child_items.insert(position, item)
 
-        return True
+        if self.dtype == ITEM_ROOT:
+            return HEADERS[column]
+        elif column == 0:
+            return self.name
+        elif column == 1:
+            return self.ifile
+        elif column == 2:
+            return DTYPES[self.dtype]
+        else:
+            return self.path
 
-    def insertColumns(self, position, columns):
-        if position < 0 or position > len(self.item_data):
+    def insertChildren(self, position, items):
+        if position < 0 or position > self.childCount():
             return False
 
-        for column in range(columns):
-            self.item_data.insert(position, None)
+        if self.child_items is None:
+            self.child_items = []
 
-        for child in self.child_items:
-            child.insert_columns(position, columns)
+        self.child_items[position:position] = items
+        for item in items:
+            item.parent_item = self
+
+        self._renumber(position)
 
         return True
 
+    def appendChild(self, item):
+        return self.insertChildren(self.childCount(), [item])
+
     def parent(self):
         return self.parent_item
 
     def removeChildren(self, position, count):
-        if position < 0 or position + count > len(self.child_items):
-            return False
-
-        for row in range(count):
-            self.child_items.pop(position)
-
-        return True
-
-    def removeColumns(self, position, columns):
-        if position < 0 or position + columns > len(self.item_data):
+        if position < 0 or position + count > self.childCount():
             return False
 
-        for column in range(columns):
-            self.item_data.pop(position)
-
-        for child in self.child_items:
-            child.removeColumns(position, columns)
+        del self.child_items[position:position+count]
 
-        return True
-
-    def setDataCol(self, column: int, value):
-        if column < 0 or column >= len(self.item_data):
-            return False
+        self._renumber(position)
 
-        self.item_data[column] = value
         return True
 
-    def setData(self, ifile, dtype, path, name):
-        self.item_data = [name, ifile, dtype, path]
-
     def __repr__(self) -> str:
         result = f"<treeitem.TreeItem at 0x{id(self):x}"
         for d in self.item_data:
-            result += f' "{d}"' if d else " <None>"
-        result += f", {len(self.child_items)} children>"
+            result += f' "{d}"' if d is not None else " <None>"
+        result += f", {self.childCount()} children>"
         return result
 
 
+class FileItem(TreeItem):
+
+    __slots__ = ('ifile',)
+
+    def __init__(self, name: str, ifile: int, parent: TreeItem = None):
+        super().__init__(name, ITEM_FILE, parent)
+        self.ifile = ifile
+
+
 class TreeModel(QAbstractItemModel):
     # Define signals
     # data_changed = Signal(QModelIndex, QModelIndex, object)
@@ -106,12 +141,48 @@ class TreeModel(QAbstractItemModel):
         super().__init__(parent)
 
         #self.root_data = headers
-        self.root_item = TreeItem(['name', 'ifile', 'dtype', 'path'])
+        self.root_item = TreeItem()
+        self.root_files = root_files
         self.setupModelData(file_names, root_files, self.root_item)
 
     def columnCount(self, parent: QModelIndex = None) -> int:
         return self.root_item.columnCount()
 
+    # Lazy population: files, directories and trees are listed on expand
+    def _is_lazy(self, item: TreeItem) -> bool:
+        return not item.fetched and item.dtype in (ITEM_FILE, ITEM_DIR, ITEM_TREE)
+
+    def hasChildren(self, parent: QModelIndex = QModelIndex()) -> bool:
+        item = self.getItem(parent)
+        if self._is_lazy(item):
+            return True
+        return item.childCount() > 0
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return self._is_lazy(self.getItem(parent))
+
+    def fetchMore(self, parent: QModelIndex):
+
+        item = self.getItem(parent)
+        if not self._is_lazy(item):
+            return
+
+        item.fetched = True
+
+        if item.dtype == ITEM_FILE:
+            path = ''
+        else:
+            path = item.path
+
+        entries = self.root_files[item.ifile].list_dir(path, DTYPES[item.dtype])
+        if not entries:
+            return
+
+        first = item.childCount()
+        self.beginInsertRows(parent, first, first + len(entries) - 1)
+        item.insertChildren(first, [ TreeItem(name, DTYPE_IDS[dtype]) for dtype, path, name in entries ])
+        self.endInsertRows()
+
     def data(self, index: QModelIndex, role: int = None):
         if not index.isValid():
             return None
@@ -254,28 +325,80 @@ class TreeModel(QAbstractItemModel):
 
     def setupModelData(self, file_names, root_files, parent):
 
-        for file_idx, (name, root_file) in enumerate(zip(file_names, root_files)):
+        # only the files are added here, their contents are fetched on expand
+        for file_idx, name in enumerate(file_names):
+            parent.appendChild(FileItem(name, file_idx))
 
-            parent.insertChildren(parent.childCount(), 1, 2)
-            file_item = parent.lastChild()
-            file_item.setData(file_idx, 'file', name, name)
 
-            for depth, dtype, path, name in root_file:
+    def addFile(self, name, root_file):
 
-                if depth == 0:
-                    file_item.insertChildren(file_item.childCount(), 1, 2)
-                    file_item.lastChild().setData(file_idx, dtype, path, name)
-                else:
-                    last = file_item.lastChild()
-                    last.insertChildren(last.childCount(), 1, 2)
-                    last.lastChild().setData(file_idx, dtype, path, name)
+        file_idx = len(self.root_files)
+        self.root_files.append(root_file)
 
+        row = self.root_item.childCount()
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.root_item.appendChild(FileItem(name, file_idx))
+        self.endInsertRows()
+
+        return self.index(row, 0)
 
     def _repr_recursion(self, item: TreeItem, indent: int = 0) -> str:
         result = " " * indent + repr(item) + "\n"
-        for child in item.child_items:
+        for child in item.child_items or []:
             result += self._repr_recursion(child, indent + 2)
         return result
 
     def __repr__(self) -> str:
         return self._repr_recursion(self.root_item)
+
+
+class FileFilterProxyModel(QSortFilterProxyModel):
+    """ Show only the items matching a search, and their parents """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self._files = None
+        self._accepted = None
+
+    def getItem(self, index: QModelIndex = QModelIndex()) -> TreeItem:
+        return self.sourceModel().getItem(self.mapToSource(index))
+
+    def setMatches(self, matches):
+        """ matches: set of (ifile, path), None to show everything """
+
+        if matches is None:
+            self._files = None
+            self._accepted = None
+
+        else:
+            self._files = set()
+            self._accepted = set()
+
+            for ifile, path in matches:
+                self._files.add(ifile)
+                self._accepted.add((ifile, path))
+
+                # parents: dir/subdir/tree//branch
+                parent, sep, _ = path.rpartition('//')
+                if not sep:
+                    parent = path.rpartition('/')[0]
+
+                while parent and (ifile, parent) not in self._accepted:
+                    self._accepted.add((ifile, parent))
+                    parent = parent.rpartition('/')[0]
+
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row: int, source_parent: QModelIndex) -> bool:
+
+        if self._accepted is None:
+            return True
+
+        source_model = self.sourceModel()
+        item = source_model.getItem(source_model.index(source_row, 0, source_parent))
+
+        if item.dtype == ITEM_FILE:
+            return item.ifile in self._files
+
+        return (item.ifile, item.path) in self._accepted
@@ -0,0 +1,128 @@
+# plotter
+# history.py
+
+import os
+import json
+import time
+import fnmatch
+from array import array
+
+DATA_DIR = os.path.join(os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share')), 'plotter-qt')
+
+
+class History:
+    """
+    Append-only log of the drawn plots, one json line per plot, using the
+    same plot format as the batch specification.
+
+    An index file keeps the offset of each line (and the end of the log),
+    so opening a long history only reads the index and each entry is read
+    with a single seek.
+    """
+
+    def __init__(self, history_dir=None):
+
+        if history_dir is None:
+            history_dir = DATA_DIR
+
+        os.makedirs(history_dir, exist_ok=True)
+
+        self.log_path = os.path.join(history_dir, 'history.jsonl')
+        self.index_path = os.path.join(history_dir, 'history.idx')
+
+        self._offsets = array('Q', [0])
+
+        self._load_index()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _load_index(self):
+
+        log_size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+
+        offsets = array('Q')
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                try:
+                    offsets.fromfile(f, os.path.getsize(self.index_path) // offsets.itemsize)
+                except EOFError:
+                    offsets = array('Q')
+
+        # the index is out of sync (e.g. interrupted write), rebuild it from the log
+        if not offsets or offsets[-1] != log_size:
+            offsets = array('Q', [0])
+            if log_size:
+                with open(self.log_path, 'rb') as f:
+                    for line in f:
+                        offsets.append(offsets[-1] + len(line))
+
+            with open(self.index_path, 'wb') as f:
+                offsets.tofile(f)
+
+        self._offsets = offsets
+
+    def add(self, plot):
+
+        plot = dict(plot, time=time.time())
+        line = (json.dumps(plot) + '\n').encode()
+
+        with open(self.log_path, 'ab') as f:
+            f.write(line)
+
+        self._offsets.append(self._offsets[-1] + len(line))
+
+        # the index stores all the offsets, only the new end is appended
+        with open(self.index_path, 'ab') as f:
+            self._offsets[-1:].tofile(f)
+
+    def _read(self, f, i):
+        f.seek(self._offsets[i])
+        return json.loads(f.read(self._offsets[i+1] - self._offsets[i]))
+
+    def get(self, i):
+
+        if i < 0:
+            i += len(self)
+
+        if i < 0 or i >= len(self):
+            raise IndexError('history entry out of range')
+
+        with open(self.log_path, 'rb') as f:
+            return self._read(f, i)
+
+    def last(self, n):
+        """ Last n entries, newest first, as (index, plot) """
+        return [ (i, self.get(i)) for i in range(len(self) - 1, max(len(self) - n, 0) - 1, -1) ]
+
+    def find(self, path=None, file=None, since=None, until=None, limit=None):
+        """
+        Entries, newest first as (index, plot), with an item whose path and
+        file match the given glob patterns (the file also by its name only),
+        drawn between the since and until times (seconds since the epoch)
+        """
+
+        found = []
+        if not len(self):
+            return found
+
+        with open(self.log_path, 'rb') as f:
+            for i in range(len(self) - 1, -1, -1):
+
+                plot = self._read(f, i)
+
+                t = plot.get('time', 0)
+                if since is not None and t < since:
+                    # entries are in time order
+                    break
+                if until is not None and t > until:
+                    continue
+
+                if any((path is None or fnmatch.fnmatchcase(item['path'], path)) and
+                       (file is None or fnmatch.fnmatchcase(item['file'], file) or fnmatch.fnmatchcase(os.path.basename(item['file']), file))
+                       for item in plot['items']):
+                    found.append((i, plot))
+                    if limit is not None and len(found) >= limit:
+                        break
+
+        return found
@@ -1,9 +1,11 @@
+import os
 import sys
 
 from PySide2.QtCore import (Qt,
                             QAbstractItemModel,
                             QItemSelectionModel,
                             QModelIndex,
+                            QThreadPool,
                             Slot)
 from PySide2.QtWidgets import (QAbstractItemView,
                                QMainWindow,
@@ -14,53 +16,56 @@ from PySide2.QtWidgets import (QAbstractItemView,
                                QGridLayout,
                                QPushButton,
                                QCheckBox,
+                               QProgressBar,
+                               QSpinBox,
+                               QLabel,
+                               QLineEdit,
                                QSplitter)
 
-import ROOT
+from plotter.backends import open_file, PREVIEW_ENTRIES
 
-from plotter.rootfile import RootFile
-
-from plotter.file_model import TreeModel
+from plotter.file_model import TreeModel, FileFilterProxyModel
+from plotter.search import NameIndex
 from plotter.plot_model import PlotTable, PlotModel
+from plotter.workers import FileLoader, FileIndexer, DrawWorker, RootLoader
 
-from plotter.plot import Plot
 from plotter.history import History
-from plotter.style import default_colours
+from plotter.style import default_colours, get_plot_conf
 
 NAME    = 'plotter_qt'
 VERSION = '0.1'
 
-class MainWindow(QMainWindow):
-    def __init__(self, parent=None, file_paths=[]):
-        super().__init__(parent)
+# files are opened concurrently, mostly waiting on I/O
+MAX_LOADER_THREADS = 16
 
-        #
-        self.resize(1000, 800)
-        self.setWindowTitle(f'{NAME} ({VERSION})')
+# files listed at the same time for the search index, after they are opened
+MAX_INDEXER_THREADS = 4
 
-        # Files
-        # -------
-        self.files = []
-        file_names = []
-        for i, path in enumerate(file_paths):
-            print('Loading file %i: %s' % (i, path))
+# search results are expanded in the file view up to this number
+MAX_EXPANDED_MATCHES = 500
 
-            f = RootFile(path)
+# entries shown in the history menu
+MAX_HISTORY_MENU = 30
 
-            # check if file is valid
-            if f.is_valid():
-                self.files.append(f)
-
-                file_name = path.split('/')[-1] if '/' in path else path
-                file_names.append(file_name)
+class MainWindow(QMainWindow):
+    def __init__(self, parent=None, file_paths=[], index_cache=None, threads=1, projection_cache=None, max_canvases=10, backend='root'):
+        super().__init__(parent)
 
-            else:
-                pass
+        self.index_cache = index_cache
+        self.projection_cache = projection_cache
+        self.backend = backend
 
+        #
+        self.resize(1000, 800)
+        self.setWindowTitle(f'{NAME} ({VERSION})')
 
         # Models
         # ------
-        self.file_model = TreeModel(file_names, self.files, self)
+        self.files = []
+        self.file_model = TreeModel([], self.files, self)
+        self.file_proxy = FileFilterProxyModel(self)
+        self.file_proxy.setSourceModel(self.file_model)
+        self.name_index = NameIndex()
         self.plot_model = PlotModel()
 
 
@@ -75,8 +80,13 @@ class MainWindow(QMainWindow):
         self.w_left = QWidget()
         self.l_left = QVBoxLayout(self.w_left)
 
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText('Search (name, glob* or /regex)')
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.on_search)
+
         self.file_view = QTreeView()
-        self.file_view.setModel(self.file_model)
+        self.file_view.setModel(self.file_proxy)
 
         self.file_view.setSelectionBehavior(QAbstractItemView.SelectItems)
         self.file_view.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
@@ -93,11 +103,11 @@ class MainWindow(QMainWindow):
         self.file_view.clicked.connect(self.on_click)
 
         self.file_view.setHeaderHidden(True)
-        self.file_view.expandToDepth(0)
         self.file_view.hideColumn(1)
         self.file_view.hideColumn(2)
         self.file_view.hideColumn(3)
 
+        self.l_left.addWidget(self.search_box)
         self.l_left.addWidget(self.file_view)
 
         ## Right: Plot view and buttons
@@ -116,23 +126,57 @@ class MainWindow(QMainWindow):
         self.check_logx = QCheckBox('x log')
         self.check_logy = QCheckBox('y log')
         self.check_ratio = QCheckBox('Ratio')
-
+        self.check_stack = QCheckBox('Stack')
+        self.check_stack.setToolTip('Stack the histograms over the first one')
+        self.check_live = QCheckBox('Live')
+        self.check_live.setToolTip('Update the plot while the trees are being read')
+        self.check_preview = QCheckBox('Preview')
+        self.check_preview.setToolTip('Read only a sample of the large trees, scaled to all the entries')
+
+        self.w_threads = QWidget()
+        self.l_threads = QHBoxLayout(self.w_threads)
+        self.l_threads.setContentsMargins(0, 0, 0, 0)
+        self.spin_threads = QSpinBox()
+        self.spin_threads.setRange(1, 256)
+        self.spin_threads.setValue(threads)
+        self.l_threads.addWidget(QLabel('Threads'))
+        self.l_threads.addWidget(self.spin_threads)
+
+        self.button_add_all = QPushButton('Add from all files')
         self.button_clear = QPushButton('Clear')
         self.button_draw = QPushButton('Draw')
+        self.button_full = QPushButton('Full')
+        self.button_full.setToolTip('Draw the last preview with all the entries')
+        self.button_full.setEnabled(False)
+        self.button_stop = QPushButton('Stop')
+        self.button_stop.setEnabled(False)
 
         self.l_buttons.addWidget(self.check_logx)
         self.l_buttons.addWidget(self.check_logy)
         self.l_buttons.addWidget(self.check_ratio)
+        self.l_buttons.addWidget(self.check_stack)
+        self.l_buttons.addWidget(self.check_live)
+        self.l_buttons.addWidget(self.check_preview)
+        self.l_buttons.addWidget(self.w_threads)
+        self.l_buttons.addWidget(self.button_add_all)
         self.l_buttons.addWidget(self.button_clear)
         self.l_buttons.addWidget(self.button_draw)
+        self.l_buttons.addWidget(self.button_full)
+        self.l_buttons.addWidget(self.button_stop)
 
         self.button_draw.clicked.connect(self.on_button_draw)
+        self.button_full.clicked.connect(self.on_button_full)
+        self.button_add_all.clicked.connect(self.on_button_add_all)
         self.button_clear.clicked.connect(self.on_button_clear)
+        self.button_stop.clicked.connect(self.on_button_stop)
 
         # self.button_draw.setShortcut(QKeySequence('Ctrl+D'))
 
 
-        # menubar = self.menuBar()
+        menubar = self.menuBar()
+        self.history_menu = menubar.addMenu("&History")
+        self.history_menu.aboutToShow.connect(self.update_history_menu)
+
         # file_menu = menubar.addMenu("&File")
         # self.exit_action = file_menu.addAction("E&xit")
         # self.exit_action.setShortcut("Ctrl+Q")
@@ -151,42 +195,336 @@ class MainWindow(QMainWindow):
         # layout->addWidget(sizeGrip, 0,0,1,1,Qt::AlignBottom | Qt::AlignRight);
 
         #
-        self.plots = []
+        # created with the first plot, plotter.plot needs ROOT
+        self.max_canvases = max_canvases
+        self.canvases = None
+        self.stack_cache = None
+        self.label_canvases = QLabel()
+        self.statusBar().addPermanentWidget(self.label_canvases)
         self.history = History()
 
+        # objects are produced in a single worker thread, one draw job at a time
+        self.draw_pool = QThreadPool(self)
+        self.draw_pool.setMaxThreadCount(1)
+        self.draw_job = None
+        self.draw_job_id = 0
 
-    ## Draw
-    def draw(self):
+        # plot being updated by a live draw job
+        self.live_plot = None
+
+        # items of the last preview, with their binning, to draw them in full
+        self.preview_items = None
+
+        # ROOT takes a few seconds to load: do it in the background while
+        # the window is shown, the first user of ROOT waits for it
+        root_loader = RootLoader()
+        root_loader.signals.loaded.connect(self.on_root_loaded)
+        root_loader.signals.failed.connect(self.on_root_failed)
+        QThreadPool.globalInstance().start(root_loader)
 
-        if not self.plot_model or self.plot_model.rowCount() < 1:
+        # Files
+        # -------
+        self.load_files(file_paths)
+
+
+    ## Files
+    def load_files(self, file_paths):
+
+        if not file_paths:
             return
 
+        self.loader_pool = QThreadPool(self)
+        self.loader_pool.setMaxThreadCount(min(len(file_paths), MAX_LOADER_THREADS))
+
+        self.loader_paths = list(file_paths)
+        self.loader_done = 0
+
+        self.indexer_pool = QThreadPool(self)
+        self.indexer_pool.setMaxThreadCount(min(len(file_paths), MAX_INDEXER_THREADS))
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, len(file_paths))
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat('Loading files %v/%m')
+        self.statusBar().addPermanentWidget(self.progress_bar)
+
+        for i, path in enumerate(file_paths):
+            print('Loading file %i: %s' % (i, path))
+
+            loader = FileLoader(i, path, self.index_cache, self.projection_cache, self.backend)
+            loader.signals.loaded.connect(self.on_file_loaded)
+            loader.signals.failed.connect(self.on_file_failed)
+            self.loader_pool.start(loader)
+
+    def update_load_progress(self):
+
+        self.loader_done += 1
+        self.progress_bar.setValue(self.loader_done)
+
+        if self.loader_done == len(self.loader_paths):
+            self.statusBar().removeWidget(self.progress_bar)
+
+    @Slot(int, object)
+    def on_file_loaded(self, idx, root_file):
+
+        path = self.loader_paths[idx]
+        file_name = path.split('/')[-1] if '/' in path else path
+
+        index = self.file_model.addFile(file_name, root_file)
+        self.file_view.expand(self.file_proxy.mapFromSource(index))
+
+        indexer = FileIndexer(self.file_model.getItem(index).ifile, root_file)
+        indexer.signals.indexed.connect(self.on_file_indexed)
+        self.indexer_pool.start(indexer)
+
+        self.update_load_progress()
+
+    @Slot(int, object)
+    def on_file_indexed(self, ifile, segment):
+
+        self.name_index.add_segment(ifile, segment)
+        if self.search_box.text():
+            self.on_search(self.search_box.text())
+
+    @Slot(int, str)
+    def on_file_failed(self, idx, msg):
+
+        path = self.loader_paths[idx]
+        print('Error loading file %s: %s' % (path, msg))
+        self.statusBar().showMessage('Error loading file %s: %s' % (path, msg))
+
+        self.update_load_progress()
+
+
+    ## Draw
+    def draw(self, items=None, preview=None):
+        """ Draw the items of the plot table, or the given ones """
+
+        if items is None:
+            if not self.plot_model or self.plot_model.rowCount() < 1:
+                return
+            items = [ list(item) for item in self.plot_model.getItems() ]
+
+        if preview is None:
+            preview = self.check_preview.isChecked()
+
+        for item in items:
+            print(*item)
+
+        # a new draw replaces the running one
+        self.cancel_draw()
+
+        self.draw_job_id += 1
+        self.draw_job = DrawWorker(self.draw_job_id, self.files, items, self.spin_threads.value(),
+                                   self.check_live.isChecked(), PREVIEW_ENTRIES if preview else None)
+        self.draw_job.signals.progress.connect(self.on_draw_progress)
+        self.draw_job.signals.partial.connect(self.on_draw_partial)
+        self.draw_job.signals.finished.connect(self.on_draw_finished)
+        self.draw_job.signals.failed.connect(self.on_draw_failed)
+        self.draw_pool.start(self.draw_job)
+
+        self.button_stop.setEnabled(True)
+        self.statusBar().showMessage('Drawing ...')
+
+        self.clear_plot()
+
+    def cancel_draw(self):
+
+        if self.draw_job is not None:
+            self.draw_job.cancel()
+            self.draw_job = None
+
+        # a cancelled live plot stays as it is
+        self.live_plot = None
+
+        self.button_stop.setEnabled(False)
+
+    def render(self, job, objects, replace=None, final=True):
+        """ Create the plot of a draw job, in the canvas of replace if given. Returns the plot """
+
+        missing = [ '%s:%s' % (self.files[item[0]].name, item[2]) for item, obj in zip(job.items, objects) if obj is None ]
+        if missing and final:
+            self.statusBar().showMessage('Missing objects: ' + ', '.join(missing))
+
+        if not any(obj is not None for obj in objects):
+            return replace
+
+        from plotter.plot import Plot, CanvasManager, StackCache
+
+        if self.canvases is None:
+            self.canvases = CanvasManager(self.max_canvases)
+            self.stack_cache = StackCache()
+
         plot = Plot()
 
-        # add objects
-        first_hist_norm = None
-        for (ifile, item, path, color, opts, sel) in self.plot_model.getItems():
+        # what identifies the content of the objects, for the stack cache.
+        # partial and preview objects are not kept
+        use_keys = final and job.preview_fraction >= 1
 
-            print(ifile, item, path, color, opts, sel)
-            obj = self.files[ifile].get_object(path, sel).Clone()
-            obj.SetDirectory(0)
-            ROOT.SetOwnership(obj, False)
-            plot.add(obj, color, opts)
+        for item, obj in zip(job.items, objects):
+            if obj is None:
+                continue
 
+            obj, color, opts = obj
+            key = (self.files[item[0]].uuid, item[2], item[5], PlotModel.getBinning(item)) if use_keys else None
+
+            plot.add(obj, color, opts, key=key)
 
         plot.set_logx(self.check_logx.isChecked())
         plot.set_logy(self.check_logy.isChecked())
+        plot.set_stack(self.check_stack.isChecked(), self.stack_cache)
+
+        if job.preview_fraction < 1:
+            plot.set_note('Preview: %.2g%% of the entries, scaled' % (100 * job.preview_fraction))
 
+        self.canvases.draw(plot, self.check_ratio.isChecked(), replace)
+        self.update_canvases_label()
 
-        plot.create()
+        if final:
+            self.history.add(self.plot_spec(job.items))
 
-        self.plots.append(plot)
-        plot.canvas.Update()
+        return plot
+
+    def update_canvases_label(self):
+        ncanvases, nobjects, nbytes = self.canvases.get_stats()
+        self.label_canvases.setText(f'{ncanvases} canvases, {nobjects} objects, {nbytes/1024/1024:.1f} MB')
+
+    @Slot()
+    def on_root_loaded(self):
+        self.statusBar().showMessage('ROOT loaded', 2000)
+
+    @Slot(str)
+    def on_root_failed(self, error):
+        self.statusBar().showMessage('Error loading ROOT: %s' % error)
+
+    ## History
+    def plot_spec(self, items):
+        """ Plot description stored in the history, same format as the batch specification """
+
+        spec_items = []
+        for ifile, _, path, color, opts, sel, nbins, xmin, xmax in items:
+            binning = None if None in (nbins, xmin, xmax) else [nbins, xmin, xmax]
+            spec_items.append({
+                'file': os.path.abspath(self.files[ifile].path),
+                'path': path,
+                'colour': color,
+                'options': ' '.join(opts) if isinstance(opts, (tuple, list)) else opts,
+                'selection': sel,
+                'binning': binning,
+            })
+
+        return {
+            'items': spec_items,
+            'logx': self.check_logx.isChecked(),
+            'logy': self.check_logy.isChecked(),
+            'ratio': self.check_ratio.isChecked(),
+            'stack': self.check_stack.isChecked(),
+        }
+
+    def update_history_menu(self):
+
+        self.history_menu.clear()
+
+        action = self.history_menu.addAction('Redraw last\tCtrl+R')
+        action.triggered.connect(lambda: self.replay(-1))
+        action.setEnabled(len(self.history) > 0)
+
+        self.history_menu.addSeparator()
+
+        for i, spec in self.history.last(MAX_HISTORY_MENU):
+            text = ', '.join(item['path'] for item in spec['items'])
+            action = self.history_menu.addAction(f'{i}: {text}')
+            action.triggered.connect(lambda checked=False, i=i: self.replay(i))
+
+    def replay(self, i):
+        """ Draw again an entry of the history, projections come from the caches """
+
+        if not len(self.history):
+            return
+
+        spec = self.history.get(i)
+
+        file_indices = { os.path.abspath(f.path): ifile for ifile, f in enumerate(self.files) }
 
-        self.history.add([ item for item in self.plot_model.getItems() ])
         self.clear_plot()
 
-        print(self.history._history)
+        for idx, item in enumerate(spec['items']):
+
+            # open the files that are not loaded anymore
+            ifile = file_indices.get(item['file'])
+            if ifile is None:
+                try:
+                    root_file = open_file(item['file'], self.backend, self.index_cache, self.projection_cache)
+                except Exception as e:
+                    print('Error loading file %s: %s' % (item['file'], e))
+                    root_file = None
+
+                if root_file is None or not root_file.is_valid():
+                    self.statusBar().showMessage('Error loading file %s' % item['file'])
+                    continue
+                index = self.file_model.addFile(os.path.basename(item['file']), root_file)
+                ifile = file_indices[item['file']] = self.file_model.getItem(index).ifile
+
+            nbins, xmin, xmax = item['binning'] if item.get('binning') else (None, None, None)
+
+            self.plot_model.addItem((ifile, idx, item['path'], item['colour'], (item['options'],),
+                                     item['selection'], nbins, xmin, xmax))
+
+        self.check_logx.setChecked(spec.get('logx', False))
+        self.check_logy.setChecked(spec.get('logy', False))
+        self.check_ratio.setChecked(spec.get('ratio', False))
+        self.check_stack.setChecked(spec.get('stack', False))
+
+        self.draw()
+
+    @Slot(int, int, int)
+    def on_draw_progress(self, job_id, done, total):
+        if job_id == self.draw_job_id:
+            self.statusBar().showMessage(f'Drawing ... {done}/{total}')
+
+    @Slot(int, object)
+    def on_draw_finished(self, job_id, objects):
+
+        if self.draw_job is None or job_id != self.draw_job_id:
+            return
+
+        job = self.draw_job
+        self.draw_job = None
+        self.button_stop.setEnabled(False)
+        self.statusBar().clearMessage()
+
+        self.render(job, objects, self.live_plot)
+        self.live_plot = None
+
+        # the full draw keeps the binning of the preview
+        if job.preview_fraction < 1:
+            for item, obj in zip(job.items, objects):
+                if obj is not None and '//' in item[2] and PlotModel.getBinning(item) is None:
+                    axis = obj[0].GetXaxis()
+                    item[6:9] = [axis.GetNbins(), axis.GetXmin(), axis.GetXmax()]
+
+            self.preview_items = job.items
+            self.button_full.setEnabled(True)
+
+    @Slot(int, object, int)
+    def on_draw_partial(self, job_id, objects, percent):
+
+        if self.draw_job is None or job_id != self.draw_job_id:
+            return
+
+        self.statusBar().showMessage(f'Drawing ... {percent}%')
+
+        self.live_plot = self.render(self.draw_job, objects, self.live_plot, final=False)
+
+    @Slot(int, str)
+    def on_draw_failed(self, job_id, msg):
+
+        if job_id != self.draw_job_id:
+            return
+
+        self.draw_job = None
+        self.button_stop.setEnabled(False)
+        self.statusBar().showMessage(f'Error drawing: {msg}')
 
     def clear_plot(self):
         self.plot_model.clear()
@@ -200,13 +538,44 @@ class MainWindow(QMainWindow):
         if index is None:
             index = self.file_view.selectedIndexes()[0]
 
-        name, ifile, dtype, path = self.file_model.getItem(index).item_data
+        name, ifile, dtype, path = self.file_proxy.getItem(index).item_data
 
         if dtype in ('hist', 'graph', 'branch'):
-            idx = self.plot_model.rowCount()
-            color = default_colours[idx]
-            opts = '' if idx == 0 else 'same',
-            self.plot_model.addItem((ifile, idx, path, color, opts, ''))
+            self.add_item(ifile, dtype, path, name)
+
+    def add_to_plot_all(self, index=None):
+        """ Add the same object from every open file """
+
+        if index is None:
+            index = self.file_view.selectedIndexes()[0]
+
+        name, _, dtype, path = self.file_proxy.getItem(index).item_data
+
+        if dtype not in ('hist', 'graph', 'branch'):
+            return
+
+        missing = []
+        for ifile, root_file in enumerate(self.files):
+            if root_file.has_object(path):
+                self.add_item(ifile, dtype, path, name)
+            else:
+                missing.append(root_file.name)
+
+        if missing:
+            self.statusBar().showMessage(f'{path} not found in: ' + ', '.join(missing))
+
+    def add_item(self, ifile, dtype, path, name):
+
+        idx = self.plot_model.rowCount()
+        color = default_colours[idx % len(default_colours)]
+        opts = '' if idx == 0 else 'same',
+
+        binning = None
+        if dtype == 'branch':
+            binning = get_plot_conf(name).get_binning()
+        nbins, xmin, xmax = binning if binning else (None, None, None)
+
+        self.plot_model.addItem((ifile, idx, path, color, opts, '', nbins, xmin, xmax))
 
 
     def keyPressEvent(self, event):
@@ -230,16 +599,25 @@ class MainWindow(QMainWindow):
             elif key == Qt.Key_Y:
                 self.check_logy.toggle()
 
+            elif key == Qt.Key_R:
+                self.replay(-1)
+
+            elif key == Qt.Key_Right and event.modifiers() & Qt.ShiftModifier:
+                self.add_to_plot_all()
+
             elif key == Qt.Key_Right:
                 self.add_to_plot()
 
+        elif key == Qt.Key_Escape:
+            self.cancel_draw()
+
 
     def show_info(self, index):
 
         if index is None:
             index = self.file_view.selectedIndexes()[0]
 
-        ifile, name, dtype, path = self.file_model.getItem(index).item_data
+        ifile, name, dtype, path = self.file_proxy.getItem(index).item_data
 
         msg = f"({index.row()},{index.column()}) --> {ifile}, {name}, {dtype}, {path}"
         self.statusBar().showMessage(msg)
@@ -256,6 +634,23 @@ class MainWindow(QMainWindow):
 
 
 
+    @Slot(str)
+    def on_search(self, text):
+
+        if not text:
+            self.file_proxy.setMatches(None)
+            self.statusBar().clearMessage()
+            return
+
+        matches = self.name_index.search(text)
+        self.file_proxy.setMatches(matches)
+
+        # show the matches, unless there are too many
+        if len(matches) <= MAX_EXPANDED_MATCHES:
+            self.file_view.expandAll()
+
+        self.statusBar().showMessage(f'{len(matches)} matches')
+
     @Slot()
     def on_click(self, index):
         if not index.isValid():
@@ -275,6 +670,21 @@ class MainWindow(QMainWindow):
     def on_button_draw(self):
         self.draw()
 
+    @Slot()
+    def on_button_add_all(self):
+        if self.file_view.selectedIndexes():
+            self.add_to_plot_all()
+
     @Slot()
     def on_button_clear(self):
         self.clear_plot()
+
+    @Slot()
+    def on_button_full(self):
+        if self.preview_items is not None:
+            self.draw([ list(item) for item in self.preview_items ], preview=False)
+
+    @Slot()
+    def on_button_stop(self):
+        self.cancel_draw()
+        self.statusBar().showMessage('Draw cancelled')
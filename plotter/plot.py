@@ -1,23 +1,31 @@
 # plotter
 # plot.py
 
-import ROOT
+import os
+from collections import OrderedDict
 
-from PySide2.QtCore import QModelIndex, Qt, QAbstractItemModel, Signal
+import numpy as np
 
+from plotter.backends import load_root
+from plotter.arrays import get_arrays, get_cells
+from plotter.ratio import ratio_graphs, ratio_range
 from plotter.style import *
+from plotter.cache import hist_nbytes
+
+ROOT = load_root()
 
 
 class Plot:
 
     number_of_plot = 0
 
-    def __init__(self):
+    def __init__(self, name=None):
 
-        self.name = 'plot_%d' % Plot.number_of_plot
+        self.name = name if name else 'plot_%d' % Plot.number_of_plot
 
         self.canvas = None
         self.legend = None
+        self.pads = ()
 
         self.xmin = 0
         self.xmax = 100
@@ -29,11 +37,24 @@ class Plot:
         self.objects  = []
         self.labels   = []
         self.opts = []
+        self.keys = []
 
         self.logx = False
         self.logy = False
         self.logz = False
 
+        # text shown in the top left corner (e.g. preview)
+        self.note = ''
+        self.note_text = None
+
+        # frame, reference band, line and graphs of the ratio pad
+        self.ratio_objects = []
+
+        # the objects after the first one stacked, (stack, total) once built
+        self.stack = False
+        self.stack_cache = None
+        self._stack = None
+
         Plot.number_of_plot = Plot.number_of_plot + 1
 
     @classmethod
@@ -44,10 +65,38 @@ class Plot:
         del self.canvas
         del self.legend
 
-    def save(self, extension='pdf'):
-        if self.canvas or not self.canvas.IsOnHeap():
+    def release_canvas(self):
+        """ Detach the canvas from this plot so it can be reused, the objects are dropped """
+
+        canvas = self.canvas
+        if canvas:
+            canvas.Clear()
+
+        self.canvas = None
+        self.legend = None
+        self.note_text = None
+        self.ratio_objects = []
+        self._stack = None
+        self.pads = ()
+        self.objects = []
+
+        return canvas
+
+    def close_canvas(self):
+        """ Delete the canvas, for the plots that are only saved """
+
+        canvas = self.canvas
+        self.release_canvas()
+
+        # created without python ownership, it would live until the end
+        if canvas:
+            canvas.Close()
+            ROOT.SetOwnership(canvas, True)
+
+    def save(self, extension='pdf', output_dir=''):
+        if not self.canvas:
             return
-        self.canvas.Print(self.name + '.'+ extension)
+        self.canvas.Print(os.path.join(output_dir, self.name + '.'+ extension))
 
 
     def set_logx(self, val):
@@ -56,7 +105,88 @@ class Plot:
     def set_logy(self, val):
         self.logy = val
 
-    def add(self, obj, colour, opts=[], label=''):
+    def set_note(self, text):
+        self.note = text
+
+    def set_stack(self, val, cache=None):
+        """ Stack the objects after the first one, with an optional StackCache kept across plots """
+        self.stack = val
+        self.stack_cache = cache
+
+    def get_stack(self):
+        """
+        THStack of the objects after the first one, sorted by integral with the
+        largest on top, and their sum. None if they are not 1D histograms with
+        the same number of bins.
+
+        With a stack cache and keys for all the objects, the order and the sum
+        are reused by the next plots of the same objects, so a colour or order
+        change does not sum them again.
+        """
+
+        if self._stack is not None:
+            return self._stack
+
+        components = self.objects[1:]
+        keys = self.keys[1:]
+
+        cells = [ get_cells(obj) for obj in components ]
+        if not components or any(c is None or obj.GetDimension() != 1 for obj, c in zip(components, cells)):
+            return None
+        if len({ len(c[0]) for c in cells }) != 1:
+            return None
+
+        # the cache entry does not depend on the order of the objects
+        use_cache = self.stack_cache is not None and None not in keys
+        if use_cache:
+            by_key = sorted(range(len(components)), key=lambda i: repr(keys[i]))
+            cache_key = tuple(repr(keys[i]) for i in by_key)
+            cached = self.stack_cache.get(cache_key)
+        else:
+            cached = None
+
+        if cached is not None:
+            positions, total = cached
+            order = [ by_key[p] for p in positions ]
+
+            total = total.Clone(self.name + '_total')
+            total.SetDirectory(0)
+
+        else:
+            # all the components in one (components, cells) array
+            contents = np.array([ c[0] for c in cells ], dtype=np.float64)
+
+            order = [ int(i) for i in np.argsort(contents[:, 1:-1].sum(axis=1), kind='stable') ]
+
+            # unweighted histograms have sumw2 = contents
+            sumw2 = np.sum([ c[1] if c[1] is not None else np.abs(c[0]) for c in cells ], axis=0)
+
+            total = components[0].Clone(self.name + '_total')
+            total.SetDirectory(0)
+            if not total.GetSumw2N():
+                total.Sumw2()
+
+            total_contents, total_sumw2 = get_cells(total)
+            total_contents[:] = contents.sum(axis=0)
+            total_sumw2[:] = sumw2
+            total.SetEntries(sum(obj.GetEntries() for obj in components))
+
+            if use_cache:
+                positions = [ by_key.index(i) for i in order ]
+                cached_total = total.Clone()
+                cached_total.SetDirectory(0)
+                self.stack_cache.put(cache_key, (positions, cached_total))
+
+        stack = ROOT.THStack(self.name + '_stack', '')
+        for i in order:
+            stack.Add(components[i], 'hist')
+
+        self._stack = (stack, total)
+
+        return stack, total
+
+    def add(self, obj, colour, opts=[], label='', key=None):
+        """ key identifies the content of obj across plots (e.g. file uuid, path, selection, binning) """
 
         # if ',' in opts:
         #     colour, drawopts = opts.split(',')
@@ -76,6 +206,8 @@ class Plot:
             label = obj.GetName()
         self.labels.append(label)
 
+        self.keys.append(key)
+
     def dump(self):
         text = ''
 
@@ -96,81 +228,94 @@ class Plot:
         return text
 
 
-    def compute_ranges(self):
-
-        # ymax
-        ymax = -1.e300
-        for obj in self.objects:
-            hmax = obj.GetMaximum()
-            if hmax > ymax:
-                ymax = hmax
+    def compute_ranges(self, xmin=None, xmax=None, objects=None):
+        """
+        x range of all the objects, unless given, and y range of the bins/points
+        inside it including their errors. With log y the minimum is positive.
+        """
 
-        # ymin
-        ymin = 1.e300
-        for obj in self.objects:
-            hmin = obj.GetMinimum()
-            if hmin < ymin:
-                ymin = hmin
+        if objects is None:
+            objects = self.objects
 
-        # xmax
-        xmax = -1.e300
-        for obj in self.objects:
-            hmax = obj.GetXaxis().GetXmax()
-            if hmax > xmax:
-                xmax = hmax
+        # (x low, x high, y low, y, y high) of all the bins/points in one go
+        arrays = []
+        others = []
+        for obj in objects:
+            a = get_arrays(obj)
+            if a is None:
+                others.append(obj)
+            else:
+                xl, xh, y, eyl, eyh = a
+                arrays.append((xl, xh, y - eyl, y, y + eyh))
 
-        # xmin
-        xmin = 1.e300
-        for obj in self.objects:
-            hmin = obj.GetXaxis().GetXmin()
-            if hmin < xmin:
-                xmin = hmin
+        xl, xh, yl, y, yh = ( np.concatenate(columns) for columns in zip(*arrays) ) if arrays else [np.empty(0)] * 5
 
-        return xmin, xmax, ymin, ymax
+        # other objects (e.g. 2D histograms) only through their extremes
+        xls = [ obj.GetXaxis().GetXmin() for obj in others ]
+        xhs = [ obj.GetXaxis().GetXmax() for obj in others ]
+        yls = [ obj.GetMinimum() for obj in others ]
+        yhs = [ obj.GetMaximum() for obj in others ]
 
+        if xmin is None:
+            xmin = min(xls + list(xl.min(keepdims=True) if len(xl) else ()), default=0.)
+        if xmax is None:
+            xmax = max(xhs + list(xh.max(keepdims=True) if len(xh) else ()), default=1.)
 
-    def create(self, do_ratio=False):
+        # only the visible bins/points
+        visible = (xh > xmin) & (xl < xmax)
+        yl, y, yh = yl[visible], y[visible], yh[visible]
 
-        # try to guess variable
-        names = [ obj.GetName() for obj in self.objects ]
+        ymax = max(yhs + list(yh.max(keepdims=True) if len(yh) else ()), default=1.)
 
-        variable = names[0] if names else ''
+        if self.logy:
+            # where the lower error bar reaches zero the value is used
+            lows = np.where(yl > 0, yl, y)
+            lows = lows[lows > 0]
+            ymin = min([ v for v in yls if v > 0 ] + list(lows.min(keepdims=True) if len(lows) else ()), default=1.e-3)
 
-        if variable.startswith('h_'):
-            variable = variable[2:]
+            ymax = ymax * (ymax / ymin) ** 0.1 if ymax > ymin else ymin * 10.
 
-        if variable not in plots_conf:
-            vartmp = variable[:variable.find('[')]
-            conf = plots_conf.get(vartmp, None)
         else:
-            conf = plots_conf.get(variable, None)
+            ymin = min(yls + list(yl.min(keepdims=True) if len(yl) else ()) + [0.])
+
+            ymax = ymax + 0.1 * (ymax - ymin) if ymax > ymin else ymin + 1.
 
-        if conf is None:
-            last = variable.split('_')[-1]
+        return float(xmin), float(xmax), float(ymin), float(ymax)
 
-            if last in plots_conf:
-                conf = plots_conf.get(last, None)
+    def create(self, do_ratio=False, canvas=None):
 
-        if conf is None:
-            conf = plots_conf['default']
+        # try to guess variable
+        names = [ obj.GetName() for obj in self.objects ]
+
+        variable = names[0] if names else ''
+
+        conf = get_plot_conf(variable)
 
 
         xtitle = conf.xtitle
         ytitle = conf.ytitle
         xmin   = conf.xmin
         xmax   = conf.xmax
-        ymin = None
-        ymax = None
         legpos = conf.legpos
 
-        if xmin is None or xmax: ## is None or ymin is None or ymax is None:
-            xmin, xmax, ymin, ymax = self.compute_ranges()
-
-        if self.logy:
-            ymin = 0.01
+        stacked = self.get_stack() if self.stack else None
 
-        self.canvas = ROOT.TCanvas(self.name, self.name, 800, 600)
-        ROOT.SetOwnership(self.canvas, False)
+        # with a stack the highest bins are those of the total
+        if stacked:
+            xmin, xmax, ymin, ymax = self.compute_ranges(xmin, xmax, [self.objects[0], stacked[1]])
+        else:
+            xmin, xmax, ymin, ymax = self.compute_ranges(xmin, xmax)
+
+        if canvas:
+            # redraw into an existing canvas
+            self.canvas = canvas
+            self.canvas.Clear()
+            self.canvas.SetName(self.name)
+            self.canvas.SetTitle(self.name)
+            self.canvas.SetLogy(0)
+        else:
+            self.canvas = ROOT.TCanvas(self.name, self.name, 800, 600)
+            ROOT.SetOwnership(self.canvas, False)
 
         self.canvas.cd()
 
@@ -196,6 +341,9 @@ class Plot:
             cup.Draw()
             cdown.Draw()
 
+            # keep the pads alive with the plot
+            self.pads = (cup, cdown)
+
             if self.logy:
                 cup.SetLogy()
 
@@ -209,23 +357,10 @@ class Plot:
                 self.canvas.SetLogy()
 
 
-        # configure histograms
-        # for name, hist in bkg.iteritems():
-        #     set_style(hist, color=colors_dict[name], fill=True)
-        #     hist.SetLineColor(ROOT.kBlack)
-
-
-        # stack
-        #         # create SM stack
-        # sm_stack = ROOT.THStack()
-
-        # def _compare(a, b):
-        #     amax = a.GetMaximum()
-        #     bmax = b.GetMaximum()
-        #     return cmp(int(amax), int(bmax))
-
-        # for hist in sorted(bkg.itervalues(), _compare):
-        #     sm_stack.Add(hist)
+        # stacked histograms are filled with their colour
+        if stacked:
+            for obj in self.objects[1:]:
+                obj.SetFillColor(obj.GetLineColor())
 
         # add entries to legend
         if do_ratio:
@@ -253,8 +388,11 @@ class Plot:
         self.legend.SetBorderSize(0)
         self.legend.SetFillColor(0)
 
-        for obj, label in zip(self.objects, self.labels):
-            self.legend.AddEntry(obj, label)
+        for i, (obj, label) in enumerate(zip(self.objects, self.labels)):
+            if stacked and i > 0:
+                self.legend.AddEntry(obj, label, 'f')
+            else:
+                self.legend.AddEntry(obj, label)
 
 
         if do_ratio:
@@ -308,8 +446,23 @@ class Plot:
         else:
             self.canvas.RedrawAxis()
 
-        for obj, drawopts in zip(self.objects[1:], self.opts[1:]):
-            obj.Draw(drawopts)
+        if stacked:
+            stack, total = stacked
+
+            stack.Draw('hist same')
+
+            # uncertainty of the total
+            total.SetFillColor(ROOT.kBlack)
+            total.SetFillStyle(3354)
+            total.SetMarkerSize(0)
+            total.Draw('E2 same')
+
+            # the first object on top of the stack
+            chist.Draw(self.opts[0] if 'same' in self.opts[0] else self.opts[0] + ' same')
+
+        else:
+            for obj, drawopts in zip(self.objects[1:], self.opts[1:]):
+                obj.Draw(drawopts)
 
         if do_ratio:
             cup.RedrawAxis()
@@ -318,6 +471,68 @@ class Plot:
 
         self.legend.Draw()
 
+        if self.note:
+            self.note_text = ROOT.TLatex()
+            self.note_text.SetNDC()
+            self.note_text.SetTextSize(0.035)
+            self.note_text.SetTextColor(ROOT.kRed+1)
+            self.note_text.DrawLatex(0.18, 0.96 if not do_ratio else 0.92, self.note)
+
+        if do_ratio:
+            # with a stack, the first object over the total
+            if stacked:
+                self.draw_ratio(cdown, xmin, xmax, xtitle, [stacked[1], self.objects[0]])
+            else:
+                self.draw_ratio(cdown, xmin, xmax, xtitle)
+
+    def draw_ratio(self, pad, xmin, xmax, xtitle, objects=None):
+        """ Ratio of the objects to the first one, with its errors as a band around 1 """
+
+        if objects is None:
+            objects = self.objects
+
+        band, graphs = ratio_graphs(objects)
+
+        pad.cd()
+
+        rmin, rmax = ratio_range(graphs + [band])
+
+        frame = pad.DrawFrame(xmin, rmin, xmax, rmax)
+
+        # the pad is ~30% of the canvas
+        frame.GetXaxis().SetTitle(xtitle)
+        frame.GetXaxis().SetLabelSize(0.11)
+        frame.GetXaxis().SetTitleSize(0.12)
+        frame.GetXaxis().SetTitleOffset(1.2)
+        frame.GetYaxis().SetTitle('Ratio')
+        frame.GetYaxis().SetLabelSize(0.11)
+        frame.GetYaxis().SetTitleSize(0.12)
+        frame.GetYaxis().SetTitleOffset(0.5)
+        frame.GetYaxis().SetNdivisions(505)
+
+        if band is not None:
+            band.SetFillColor(ROOT.kGray)
+            band.SetLineWidth(0)
+            band.Draw('2')
+
+        line = ROOT.TLine(xmin, 1., xmax, 1.)
+        line.SetLineStyle(2)
+        line.Draw()
+
+        for obj, graph in zip(objects[1:], graphs):
+            if graph is None:
+                continue
+            graph.SetLineColor(obj.GetLineColor())
+            graph.SetMarkerColor(obj.GetLineColor())
+            graph.SetMarkerStyle(20)
+            graph.SetMarkerSize(0.8)
+            graph.Draw('P')
+
+        pad.RedrawAxis()
+
+        # drawn objects are not owned by the pad
+        self.ratio_objects = [frame, band, line] + graphs
+
 
     def draw_legend():
 
@@ -339,3 +554,95 @@ class Plot:
         for obj, lbl in zip(self.objects, self.labels):
             leg.AddEntry(obj, lbl)
         leg.Draw()
+
+
+class StackCache:
+    """
+    Order and total of the stacked histograms, by the keys of the components,
+    kept for the last max_entries stacks
+    """
+
+    def __init__(self, max_entries=20):
+
+        self.max_entries = max_entries
+
+        # sorted component keys -> (order, total), oldest first
+        self._entries = OrderedDict()
+
+    def get(self, key):
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+
+        return entry
+
+    def put(self, key, entry):
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class CanvasManager:
+    """
+    Keep at most max_canvases plots alive. When the limit is reached the
+    canvas of the least recently drawn plot is cleared and reused.
+    """
+
+    def __init__(self, max_canvases=10):
+
+        self.max_canvases = max_canvases
+
+        # canvas name -> plot, oldest first
+        self._plots = OrderedDict()
+
+    def __len__(self):
+        self._prune()
+        return len(self._plots)
+
+    def _prune(self):
+        """ Forget the plots whose canvas was closed """
+        canvases = ROOT.gROOT.GetListOfCanvases()
+        for name in [ name for name in self._plots if not canvases.FindObject(name) ]:
+            plot = self._plots.pop(name)
+            plot.canvas = None
+            plot.release_canvas()
+
+    def draw(self, plot, do_ratio=False, replace=None):
+        """ Draw a plot, in the canvas of the plot replace if given (e.g. to update a partial plot) """
+
+        self._prune()
+
+        canvas = None
+        if replace is not None and self._plots.get(replace.name) is replace:
+            del self._plots[replace.name]
+            canvas = replace.release_canvas()
+
+        elif self._plots and len(self._plots) >= self.max_canvases:
+            _, old_plot = self._plots.popitem(last=False)
+            canvas = old_plot.release_canvas()
+
+        plot.create(do_ratio, canvas)
+        plot.canvas.Update()
+
+        self._plots[plot.name] = plot
+
+    def get_stats(self):
+        """ (number of canvases, number of objects, approximate bytes used by the objects) """
+
+        self._prune()
+
+        nobjects = 0
+        nbytes = 0
+        for plot in self._plots.values():
+            for obj in plot.objects:
+                nobjects += 1
+                if obj.InheritsFrom('TH1'):
+                    nbytes += hist_nbytes(obj)
+                elif obj.InheritsFrom('TGraph'):
+                    nbytes += obj.GetN() * 4 * 8
+
+        return len(self._plots), nobjects, nbytes
@@ -1,3 +1,5 @@
+import math
+
 from PySide2.QtCore import Qt, QModelIndex, QAbstractTableModel
 from PySide2.QtWidgets import QWidget, QTableView, QHeaderView, QHBoxLayout, QSizePolicy
 
@@ -10,7 +12,7 @@ class PlotModel(QAbstractTableModel):
     def __init__(self, data=None):
         QAbstractTableModel.__init__(self)
 
-        self._headers = ['File', 'Item', 'Path', 'Color', 'Options', 'Selection']
+        self._headers = ['File', 'Item', 'Path', 'Color', 'Options', 'Selection', 'Bins', 'Min', 'Max']
         self._data = []
 
     def rowCount(self, parent=QModelIndex()):
@@ -54,11 +56,40 @@ class PlotModel(QAbstractTableModel):
         if role != Qt.EditRole:
             return False
 
-        if not value:
-            return False
-
         col, row = index.column(), index.row()
 
+        # binning columns, empty to go back to auto-binning
+        if col >= 6:
+            try:
+                if value in ('', None):
+                    value = None
+                elif col == 6:
+                    value = int(value)
+                else:
+                    value = float(value)
+            except ValueError:
+                return False
+
+            # ROOT goes back to auto-binning with an empty range, uproot fails
+            if col == 6 and value is not None and value <= 0:
+                return False
+
+            if col >= 7 and value is not None:
+                if not math.isfinite(value):
+                    return False
+
+                xmin, xmax = self._data[row][7:9]
+                if col == 7:
+                    xmin = value
+                else:
+                    xmax = value
+
+                if xmin is not None and xmax is not None and xmin >= xmax:
+                    return False
+
+        elif not value:
+            return False
+
         self._data[row][col] = value
 
         self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
@@ -80,6 +111,14 @@ class PlotModel(QAbstractTableModel):
         for item in self._data:
             yield item
 
+    @staticmethod
+    def getBinning(item):
+        """ (nbins, xmin, xmax) of an item, or None if not fully set """
+        nbins, xmin, xmax = item[6:9]
+        if nbins is None or xmin is None or xmax is None:
+            return None
+        return (nbins, xmin, xmax)
+
     def clear(self):
         self.beginRemoveRows(QModelIndex(), 0, self.rowCount()-1)
         self._data.clear()
@@ -0,0 +1,159 @@
+# plotter
+# ratio.py
+#
+# Ratios of the overlaid objects to the first one (the reference), for the
+# lower pad of the plots. Computed with numpy on the arrays of plotter.arrays.
+#
+# The ratio points are at the bins/points of the reference:
+#  - histograms with a different binning are rebinned to the reference bins,
+#    interpolating their cumulative integral at the reference edges
+#  - graphs, or histograms against a graph reference, are evaluated at the
+#    x of the reference (linear interpolation for graphs)
+#
+# The ratio errors are those of the numerator, the reference errors are
+# returned separately as a band around 1.
+
+import numpy as np
+
+from plotter.backends import load_root
+from plotter.arrays import get_arrays
+
+
+def rebin(xl, xh, y, err, edges):
+    """ Contents and errors of a histogram in other bins, from the cumulative integral """
+
+    old_edges = np.append(xl, xh[-1:])
+
+    cum = np.concatenate(([0.], np.cumsum(y)))
+    cum2 = np.concatenate(([0.], np.cumsum(err * err)))
+
+    y = np.diff(np.interp(edges, old_edges, cum))
+    err = np.sqrt(np.maximum(np.diff(np.interp(edges, old_edges, cum2)), 0.))
+
+    return y, err
+
+
+def values_at(arrays, is_hist, x):
+    """ Values and errors of a histogram (bin containing x) or graph (interpolated) at x """
+
+    xl, xh, y, eyl, eyh = arrays
+    err = 0.5 * (eyl + eyh)
+
+    if is_hist:
+        idx = np.searchsorted(xh, x, side='right')
+        inside = (idx < len(y)) & (x >= xl[0])
+        idx = np.minimum(idx, len(y) - 1)
+        return np.where(inside, y[idx], np.nan), np.where(inside, err[idx], np.nan)
+
+    xc = 0.5 * (xl + xh)
+    order = np.argsort(xc)
+    xc = xc[order]
+
+    inside = (x >= xc[0]) & (x <= xc[-1])
+
+    return (np.where(inside, np.interp(x, xc, y[order]), np.nan),
+            np.where(inside, np.interp(x, xc, err[order]), np.nan))
+
+
+def compute_ratio(ref, ref_is_hist, num, num_is_hist):
+    """
+    Ratio num/ref at the bins/points of ref, from (x low, x high, y, y error
+    low, y error high) arrays. Returns (x, x error, ratio, ratio error), with
+    the points where the reference is zero or num is not defined removed.
+    """
+
+    xl, xh, y, _, _ = ref
+    x = 0.5 * (xl + xh)
+    ex = 0.5 * (xh - xl)
+
+    if ref_is_hist and num_is_hist:
+        nxl, nxh, ny, neyl, neyh = num
+        if len(nxl) == len(xl) and np.array_equal(nxl, xl) and np.array_equal(nxh, xh):
+            values, errors = ny, 0.5 * (neyl + neyh)
+        else:
+            values, errors = rebin(nxl, nxh, ny, 0.5 * (neyl + neyh), np.append(xl, xh[-1:]))
+    else:
+        values, errors = values_at(num, num_is_hist, x)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = values / y
+        error = errors / np.abs(y)
+
+    good = np.isfinite(ratio) & np.isfinite(error)
+
+    return x[good], ex[good], ratio[good], error[good]
+
+
+def reference_band(ref):
+    """ (x, x error, 1, relative error) of the reference, where it is not zero """
+
+    xl, xh, y, eyl, eyh = ref
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error = 0.5 * (eyl + eyh) / np.abs(y)
+
+    good = np.isfinite(error)
+
+    x = 0.5 * (xl + xh)
+    ex = 0.5 * (xh - xl)
+
+    return x[good], ex[good], np.ones(good.sum()), error[good]
+
+
+def make_graph(x, ex, y, ey):
+
+    ROOT = load_root()
+
+    n = len(x)
+    if not n:
+        return ROOT.TGraphErrors()
+
+    return ROOT.TGraphErrors(n, *(np.ascontiguousarray(a, dtype=np.float64) for a in (x, y, ex, ey)))
+
+
+def ratio_graphs(objects):
+    """
+    TGraphErrors of the ratio of each object to the first one (None for the
+    objects that can not be compared), and of the reference band.
+    """
+
+    if len(objects) < 2:
+        return None, []
+
+    ref = get_arrays(objects[0])
+    if ref is None or not len(ref[2]):
+        return None, [None] * (len(objects) - 1)
+
+    ref_is_hist = objects[0].InheritsFrom('TH1')
+
+    graphs = []
+    for obj in objects[1:]:
+        num = get_arrays(obj)
+        if num is None or not len(num[2]):
+            graphs.append(None)
+            continue
+
+        graphs.append(make_graph(*compute_ratio(ref, ref_is_hist, num, obj.InheritsFrom('TH1'))))
+
+    return make_graph(*reference_band(ref)), graphs
+
+
+def ratio_range(graphs, default=(0., 2.), limits=(0., 3.)):
+    """ y range of the ratio pad covering the points and their errors, within limits """
+
+    lows = []
+    highs = []
+    for graph in graphs:
+        if graph is None or not graph.GetN():
+            continue
+        _, _, y, eyl, eyh = get_arrays(graph)
+        lows.append((y - eyl).min())
+        highs.append((y + eyh).max())
+
+    if not lows:
+        return default
+
+    low, high = min(lows), max(highs)
+    margin = 0.1 * (high - low) if high > low else 0.1
+
+    return max(low - margin, limits[0]), min(high + margin, limits[1])
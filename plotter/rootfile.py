@@ -1,113 +1,357 @@
 import os, re
+import math
+import ctypes
+import itertools
 import uuid as _uuid
 
-import ROOT
+from plotter.backends import FileBase, load_root
+
+ROOT = load_root()
+
+# ids for the names of the temporary TTree::Draw histograms
+_hist_ids = itertools.count()
 
 
 class Object:
     pass
 
-class RootFile:
 
-    def __init__(self, path):
-        self.path = path
-        self.name = path.replace(".root", "").split('/')[-1]
-        self._file = ROOT.TFile.Open(path)
+# class name -> dtype, filled on first use of each class
+_dtypes = {}
+
+def get_dtype(class_name):
+
+    if class_name in _dtypes:
+        return _dtypes[class_name]
+
+    cls = ROOT.TClass.GetClass(class_name)
+
+    if not cls or cls.InheritsFrom('TList'):
+        dtype = None
+    elif cls.InheritsFrom('TTree'):
+        dtype = 'tree'
+    elif cls.InheritsFrom('TDirectory'):
+        dtype = 'dir'
+    elif cls.InheritsFrom('TH1'):
+        dtype = 'hist'
+    elif cls.InheritsFrom('TGraph'):
+        dtype = 'graph'
+    # TODO: add RooWorkspace support
+    else:
+        dtype = None
+
+    _dtypes[class_name] = dtype
+
+    return dtype
+
+def get_threads():
+    return ROOT.GetThreadPoolSize() if ROOT.IsImplicitMTEnabled() else 1
+
+def set_threads(n):
+    """ Use n threads for the tree projections (implicit MT is disabled for n <= 1) """
+
+    if n == get_threads():
+        return
+
+    if ROOT.IsImplicitMTEnabled():
+        ROOT.DisableImplicitMT()
+
+    if n > 1:
+        ROOT.EnableImplicitMT(n)
+
+
+def good_binning(nbins, vmin, vmax, is_integer=False):
+    """ (nbins, xmin, xmax) with round limits around the values in [vmin, vmax], as TTree::Draw chooses """
+
+    # no value selected (or infinite ones)
+    if not -math.inf < vmin <= vmax < math.inf:
+        return (nbins, 0., 1.)
+
+    if vmin == vmax:
+        vmin, vmax = vmin - 1, vmax + 1
+
+    newbins, xmin, xmax = ctypes.c_int(nbins), ctypes.c_double(vmin), ctypes.c_double(vmax)
+    ROOT.THLimitsFinder.OptimizeLimits(nbins, newbins, xmin, xmax, is_integer)
+
+    nbins, xmin, xmax = newbins.value, xmin.value, xmax.value
+
+    # the upper edge is not in the last bin
+    if vmax >= xmax:
+        xmax += (xmax - xmin) / nbins
+        nbins += 1
+
+    return (nbins, xmin, xmax)
+
+
+class RootFile(FileBase):
+
+    def _open(self):
+        return ROOT.TFile.Open(self.path)
+
+    def _read_uuid(self):
+        return self._file.GetUUID().AsString()
 
     def __del__(self):
         #self._file.Close()
         pass
 
-    def __iter__(self):
-        for depth, dtype, path, name in self.browse_dir(0, ''):
-            yield (depth, dtype, path, name)
-
     def is_valid(self):
-        return True
-
-    def browse_dir(self, depth, parent_name):
+        if self._handle is None:
+            return bool(self._listing)
+        return bool(self._handle) and not self._handle.IsZombie()
 
-        cdir = self._file.GetDirectory(parent_name)
-        for key in cdir.GetListOfKeys():
-            obj = key.ReadObj()
-            name = obj.GetName()
+    def _list_entries(self, parent_name, parent_dtype):
 
-            if parent_name:
-                path = parent_name + '/' + name
-            else:
-                path = name
+        entries = []
 
-            if obj.InheritsFrom('TList'):
-                continue
+        if parent_dtype == 'tree':
+            tree = self._file.Get(parent_name)
+            for b in tree.GetListOfLeaves():
+                bname = b.GetName()
+                entries.append(('branch', parent_name + '//' + bname, bname))
 
-            if obj.IsFolder():
-                if obj.InheritsFrom('TTree'):
+        else:
+            cdir = self._file.GetDirectory(parent_name)
+            for key in cdir.GetListOfKeys():
 
-                    yield (depth, 'tree', path, name)
+                # classify from the key metadata, objects are only read when plotted
+                dtype = get_dtype(key.GetClassName())
+                if dtype is None:
+                    continue
 
-                    tree = self._file.Get(name)
-                    for b in tree.GetListOfLeaves():
-                        bname = b.GetName()
-                        yield (depth+1, 'branch', name + '//' + bname, bname)
+                name = key.GetName()
 
+                if parent_name:
+                    path = parent_name + '/' + name
+                else:
+                    path = name
+
+                entries.append((dtype, path, name))
+
+        return entries
+
+    def read_object(self, path):
+        return self._detach(self._file.Get(path))
+
+    def project(self, treename, branches):
+        """ Project a list of (name, selection, binning) of the same tree """
+
+        try:
+            return self._project_rdf(treename, branches)
+        except Exception as e:
+            # expressions only valid for TTreeFormula (e.g. Length$)
+            print('RDataFrame projection failed, using TTree::Draw:', e)
+            with self._lock:
+                return [ self._project_draw(treename, name, selection, binning) for name, selection, binning in branches ]
+
+    def _project_rdf(self, treename, branches):
+        """
+        All the branches in one RDataFrame event loop. Automatic binnings are
+        taken from the first entries only (see _auto_binnings): unlike with
+        TTree::Draw, the values of the next entries outside that range go to
+        the underflow/overflow bins.
+        """
+
+        # RDataFrame keeps every value in memory to find the axis limits of a
+        # model without them: find them first on a bounded number of entries
+        if any(binning is None for _, _, binning in branches):
+            binnings = self._auto_binnings(treename, branches)
+            if binnings is None:
+                return [None] * len(branches)
+
+            branches = [ (name, selection, binning) for (name, selection, _), binning in zip(branches, binnings) ]
+
+        # the dataframe opens the file again, the event loop runs without the lock
+        df = ROOT.RDataFrame(treename, self.path)
+
+        # one filtered node per selection, used as weight like in TTree::Draw
+        nodes = {}
+        results = []
+        for name, selection, binning in branches:
+
+            if selection not in nodes:
+                if selection:
+                    wname = '_weight%i' % len(nodes)
+                    node = df.Define(wname, '(double)(%s)' % selection).Filter(wname + ' != 0')
                 else:
-                    yield (depth, 'dir', path, name)
+                    wname, node = None, df
+                nodes[selection] = (node, wname)
 
-                    for ddepth, dtype, dpath, dname in self.browse_dir(depth+1, name):
-                        yield (ddepth, dtype, dpath, dname)
+            node, wname = nodes[selection]
 
-            elif obj.InheritsFrom('TH1'):
-                yield (depth, 'hist', path, name)
-            elif obj.InheritsFrom('TGraph'):
-                yield (depth, 'graph', path, name)
-            # TODO: add RooWorkspace support
+            nbins, xmin, xmax = binning
+            model = ROOT.RDF.TH1DModel(name, name, int(nbins), float(xmin), float(xmax))
+
+            if wname is None:
+                results.append(node.Histo1D(model, name))
             else:
-                continue
+                results.append(node.Histo1D(model, name, wname))
 
-    def get_object_info(self, path):
-        pass
+        # the first GetValue runs the event loop for all the booked histograms.
+        # the results belong to the dataframe, this is the only copy
+        hists = []
+        for (name, _, _), result in zip(branches, results):
+            hist = result.GetValue().Clone(name)
+            hist.SetDirectory(0)
+            hists.append(hist)
 
-    def get_object(self, path, selection=''):
+        return hists
 
-        print('get_object', path, selection)
+    def _project_draw(self, treename, name, selection, binning=None):
 
-        if ':' in path:
-            _, path = path.split(':')
+        tree = self._file.Get(treename)
+        if not tree:
+            return None
 
-        # tree
-        if '//' in path:
+        return self._draw(tree, name, selection, binning)
 
-            treename, name = path.split('//')
+    def _auto_binnings(self, treename, branches):
+        """
+        Binnings of a list of (name, selection, binning), the missing ones from
+        the range of the values in the first entries (up to the tree estimate,
+        as TTree::Draw), all found in one pass. None if the tree is missing
+        """
 
-            # tree = ROOT.TTree(treename, '')
-            # self._file.GetObject(treename, tree)
+        with self._lock:
             tree = self._file.Get(treename)
+            if not tree:
+                return None
+            nentries = tree.GetEstimate()
+
+        df = ROOT.RDataFrame(treename, self.path)
+
+        # Range is not available with implicit MT, where the filter keeps as
+        # many entries, but not necessarily the first ones
+        if ROOT.IsImplicitMTEnabled():
+            df = df.Filter('rdfentry_ < %i' % nentries)
+        else:
+            df = df.Range(nentries)
+
+        nodes = {}
+        ranges = {}
+        for k, (name, selection, binning) in enumerate(branches):
+
+            if binning is not None:
+                continue
+
+            if selection not in nodes:
+                nodes[selection] = df.Filter('(double)(%s) != 0' % selection) if selection else df
 
-            tree.Draw(name+'>>'+name, selection, 'goff')
+            column = '_value%i' % k
+            node = nodes[selection].Define(column, name)
+            ranges[k] = (node.Min(column), node.Max(column), node.GetColumnType(column))
 
-            #htmp = ROOT.TH1F(hname, hname, 100, 0, 100)
-            #tree.Project(hname, name, '')
+        nbins = ROOT.gEnv.GetValue('Hist.Binning.1D.x', 100)
 
-            htmp = ROOT.gDirectory.Get(name)
+        # the first GetValue runs the event loop for all of them
+        binnings = []
+        for k, (_, _, binning) in enumerate(branches):
+            if k in ranges:
+                vmin, vmax, column_type = ranges[k]
+                is_integer = any(t in column_type for t in ('int', 'Int', 'short', 'Short', 'long', 'Long', 'char', 'Char', 'bool', 'Bool'))
+                binning = good_binning(nbins, vmin.GetValue(), vmax.GetValue(), is_integer)
+            binnings.append(binning)
 
-            obj = htmp.Clone()
+        return binnings
 
-        # inside dir
-        elif '/' in path:
-            dirname, name = path.split('/')
-            obj = self._file.Get(path)
+    def _draw(self, tree, name, selection, binning=None, nentries=None, first=0):
+        """ TTree::Draw of name into a new histogram, optionally for an entry range """
 
+        # the histogram is created in the current directory, which is gROOT for
+        # all the threads: use this file instead, and a name no other call uses
+        hname = '_plotter_%i' % next(_hist_ids)
+
+        if binning is None:
+            varexp = name + '>>' + hname
         else:
-            # histogram/graph
-            obj = self._file.Get(path)
+            varexp = '%s>>%s(%i,%g,%g)' % ((name, hname) + tuple(binning))
+
+        context = ROOT.TDirectory.TContext(self._file)
+        try:
+            if nentries is None:
+                tree.Draw(varexp, selection, 'goff')
+            else:
+                tree.Draw(varexp, selection, 'goff', nentries, first)
+
+            hist = self._detach(self._file.FindObject(hname))
+        finally:
+            del context
+
+        if hist is not None:
+            hist.SetName(name)
+
+        return hist
+
+    def tree_entries(self, treename):
+        tree = self._file.Get(treename)
+        return tree.GetEntries() if tree else 0
+
+    def tree_clusters(self, treename):
+
+        tree = self._file.Get(treename)
+        if not tree:
+            return []
+
+        nentries = tree.GetEntries()
+
+        clusters = []
+        it = tree.GetClusterIterator(0)
+        start = it()
+        while start < nentries:
+            stop = it.GetNextEntry()
+            clusters.append((start, stop))
+            start = it()
+
+        return clusters
+
+    def project_ranges(self, treename, branches, ranges):
+        """
+        Project a list of (name, selection, binning) of the same tree for a list of
+        entry ranges, yields (entries done, hists) after each range
+        """
+
+        tree = self._file.Get(treename)
+        if not tree:
+            return
+
+        hists = [None] * len(branches)
+        failed = set()
+        done = 0
+
+        for start, stop in ranges:
+
+            for k, (name, selection, binning) in enumerate(branches):
+
+                if k in failed:
+                    continue
+
+                # the first range fixes the binning, the next ones are added to it
+                if hists[k] is None:
+                    hists[k] = self._draw(tree, name, selection, binning, stop - start, start)
+                    if hists[k] is None:
+                        failed.add(k)
+                    continue
+
+                axis = hists[k].GetXaxis()
+                chunk = self._draw(tree, name, selection, (axis.GetNbins(), axis.GetXmin(), axis.GetXmax()), stop - start, start)
+                if chunk is not None:
+                    hists[k].Add(chunk)
+
+            done += stop - start
+
+            yield done, hists
+
+    @staticmethod
+    def _detach(obj):
+        """ Take an object out of its directory, so that python owns it """
+
+        if not obj:
+            return None
 
-        if obj is None:
-            pass
+        # otherwise the next Get would return this same object
+        if obj.InheritsFrom('TH1'):
+            obj.SetDirectory(0)
 
-        # try:
-        #     ROOT.SetOwnership(obj, False)
-        #     #obj.SetDirectory(0)
-        # except:
-        #     pass
+        ROOT.SetOwnership(obj, True)
 
         return obj
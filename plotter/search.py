@@ -0,0 +1,157 @@
+# plotter
+# search.py
+
+import re
+import bisect
+import fnmatch
+from itertools import accumulate
+
+
+class NameSegment:
+    """
+    Sorted object names of one file. Built once per file, off the GUI thread
+    for large files, so adding a file does not touch the others.
+    """
+
+    def __init__(self, entries):
+
+        pairs = sorted((name.lower(), path) for path, name in entries)
+
+        self.names = [ name for name, _ in pairs ]   # sorted lowercase names
+        self.paths = [ path for _, path in pairs ]
+
+        self.blob = '\n'.join(self.names)
+        self.offsets = [0] + list(accumulate(len(name) + 1 for name in self.names))[:-1]
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefix_range(self, prefix):
+        lo = bisect.bisect_left(self.names, prefix)
+        hi = bisect.bisect_left(self.names, prefix + '￿')
+        return lo, hi
+
+    def _row(self, offset):
+        return bisect.bisect_right(self.offsets, offset) - 1
+
+    def blob_search(self, regex, start=0, end=None):
+        """ Rows matching a regex, ^ and $ are the limits of each name """
+
+        if end is None:
+            end = len(self.blob)
+
+        rows = []
+        last = -1
+        for m in regex.finditer(self.blob, start, end):
+            if m.start() <= last:
+                continue
+            i = self._row(m.start())
+            rows.append(i)
+            last = self.offsets[i] + len(self.names[i])
+
+        return rows
+
+
+class NameIndex:
+    """
+    Index of the object names of all the open files.
+
+    Names are kept sorted (lowercase), one segment per file, so prefixes are
+    found with a binary search, and joined in a single string so substrings
+    are found with the C string search instead of a python loop.
+
+    Search text:
+      - 'met_et'  substring (case insensitive)
+      - 'met_*'   glob, the literal prefix narrows the search
+      - '/^met.*' regular expression
+    """
+
+    def __init__(self):
+        self._segments = {}   # ifile -> NameSegment
+
+    def __len__(self):
+        return sum(len(segment) for segment in self._segments.values())
+
+    def add_file(self, ifile, entries):
+        """ Add the (path, name) entries of a file """
+        self.add_segment(ifile, NameSegment(entries))
+
+    def add_segment(self, ifile, segment):
+        """ Add the names of a file, already sorted in a NameSegment """
+        self._segments[ifile] = segment
+
+    @staticmethod
+    def _glob_to_regex(text):
+        """ Like fnmatch.translate, but wildcards do not cross names """
+
+        # leading/trailing * just drop the anchor, much faster than [^\n]*
+        head = '' if text.startswith('*') else '^'
+        tail = '' if text.endswith('*') else '$'
+
+        regex = ''
+        for part in re.split(r'([*?])', text.strip('*')):
+            if part == '*':
+                regex += '[^\\n]*'
+            elif part == '?':
+                regex += '[^\\n]'
+            else:
+                regex += re.escape(part)
+
+        return re.compile(head + regex + tail, re.MULTILINE)
+
+    @classmethod
+    def _matcher(cls, text):
+        """ Function returning the matching rows of a segment, None if text is not valid """
+
+        # regex
+        if text.startswith('/'):
+            try:
+                regex = re.compile(text[1:], re.IGNORECASE | re.MULTILINE)
+            except re.error:
+                return None
+            return lambda segment: segment.blob_search(regex)
+
+        # substring
+        if not any(c in text for c in '*?['):
+            regex = re.compile(re.escape(text.lower()))
+            return lambda segment: segment.blob_search(regex)
+
+        # glob
+        text = text.lower()
+        prefix = re.split(r'[*?\[]', text, 1)[0]
+
+        if text == prefix + '*':
+            return lambda segment: range(*segment.prefix_range(prefix))
+
+        if '[' in text:
+            regex = re.compile(fnmatch.translate(text))
+        else:
+            regex = cls._glob_to_regex(text)
+
+        def match(segment):
+
+            lo, hi = segment.prefix_range(prefix)
+            if lo == hi:
+                return []
+
+            if '[' in text:
+                return [ i for i in range(lo, hi) if regex.match(segment.names[i]) ]
+
+            # only the names with the literal prefix are searched
+            start = segment.offsets[lo]
+            end = segment.offsets[hi-1] + len(segment.names[hi-1])
+            return segment.blob_search(regex, start, end)
+
+        return match
+
+    def search(self, text):
+        """ Return the set of (ifile, path) whose name matches """
+
+        if not text or not self._segments:
+            return set()
+
+        match = self._matcher(text)
+        if match is None:
+            return set()
+
+        return { (ifile, segment.paths[i]) for ifile, segment in self._segments.items() for i in match(segment) }
@@ -0,0 +1,91 @@
+# plotter
+# startup.py
+#
+# Startup profiling (--profile-startup): time of each import, in total and
+# without the modules imported while it ran, and of the startup steps.
+# Imports are listed as they finish, so nested imports come first.
+
+import sys
+import time
+import builtins
+import threading
+import importlib.util
+
+
+class StartupProfile:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+
+        # (label, seconds since start)
+        self.marks = []
+
+        # (module, thread, depth, total seconds, own seconds), in import order
+        self.imports = []
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._import = None
+
+    def install(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+
+        module = name
+        if level and globals:
+            try:
+                module = importlib.util.resolve_name('.' * level + name, globals.get('__package__'))
+            except (ImportError, ValueError):
+                pass
+
+        # already imported: nothing to time
+        if module in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        # the time of the nested imports is accumulated in the parent frame
+        stack.append(0.)
+        depth = len(stack) - 1
+
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            total = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += total
+
+            with self._lock:
+                self.imports.append((module, threading.current_thread().name, depth, total, total - nested))
+
+    def mark(self, label):
+        with self._lock:
+            self.marks.append((label, time.perf_counter() - self.start))
+
+    def report(self, min_seconds=0.005):
+
+        with self._lock:
+            marks = list(self.marks)
+            imports = list(self.imports)
+
+        print('Startup steps:')
+        for label, t in marks:
+            print('  %8.3f s  %s' % (t, label))
+
+        print('Imports slower than %.0f ms (total, self):' % (min_seconds * 1000))
+        for name, thread, depth, total, own in imports:
+            if total < min_seconds:
+                continue
+            where = '' if thread == 'MainThread' else '  [%s]' % thread
+            print('  %8.3f s %8.3f s  %s%s%s' % (total, own, '  ' * depth, name, where))
@@ -1,9 +1,14 @@
 # plotter/style.py
+#
+# ROOT is loaded by the functions that need it, so that the colours and
+# plot configurations can be used (e.g. by the GUI models) without loading it.
 
-import ROOT
+from array import array
+
+from plotter.backends import load_root
 
 colourdict = {
-    'black':       ROOT.kBlack,
+    'black':       '#000000',
     'orange':      '#E24A33',
     'purple':      '#7A68A6',
     'blue':        '#348ABD',
@@ -23,6 +28,8 @@ def get_color(c):
     if not isinstance(c, str):
         return c
 
+    ROOT = load_root()
+
     if c.startswith('#'):
         colour = ROOT.TColor.GetColor(c)
     else:
@@ -72,6 +79,7 @@ def set_style(obj, color='kBlack'):
     set_color(obj, color) #, fill, alpha)
 
 def set_palette():
+    ROOT = load_root()
     s = array('d', [0.00, 0.34, 0.61, 0.84, 1.00])
     r = array('d', [0.00, 0.00, 0.87, 1.00, 0.51])
     g = array('d', [0.00, 0.81, 1.00, 0.20, 0.00])
@@ -80,6 +88,7 @@ def set_palette():
     ROOT.gStyle.SetNumberContours(999)
 
 def set_default_style():
+    ROOT = load_root()
     set_palette()
     ROOT.gStyle.SetPadTickX(1)
     ROOT.gStyle.SetPadTickY(1)
@@ -124,12 +133,19 @@ colors = [
 
 # plots configuration
 class PlotConf(object):
-    def __init__(self, xtitle, ytitle, legpos, xmin=None, xmax=None):
+    def __init__(self, xtitle, ytitle, legpos, xmin=None, xmax=None, nbins=None):
         self.xtitle = xtitle
         self.ytitle = ytitle
         self.legpos = legpos
         self.xmin = xmin
         self.xmax = xmax
+        self.nbins = nbins
+
+    def get_binning(self):
+        """ (nbins, xmin, xmax) to project a branch, None to let ROOT choose """
+        if self.nbins is None or self.xmin is None or self.xmax is None:
+            return None
+        return (self.nbins, self.xmin, self.xmax)
 
 plots_conf = dict()
 plots_conf['default'] = PlotConf('','', 'right')
@@ -142,14 +158,37 @@ plots_conf['ph_pt']           = PlotConf('p_{T}^{#gamma} [GeV]', 'Events / (BIN
 plots_conf['ph_eta']          = PlotConf('Photon #eta', 'Events / (BIN GeV)', 'right')
 plots_conf['ph_phi']          = PlotConf('Photon #phi', 'Events / (BIN GeV)', 'right')
 plots_conf['ph_iso']          = PlotConf('E_{T}^{iso} [GeV]', 'Events (1/BIN GeV)', 'right')
-plots_conf['met_et']          = PlotConf('E_{T}^{miss} [GeV]', 'Events / (BIN GeV)', 'right', 0, 500)
+plots_conf['met_et']          = PlotConf('E_{T}^{miss} [GeV]', 'Events / (BIN GeV)', 'right', 0, 500, 50)
 plots_conf['met_phi']         = PlotConf('#phi^{miss}', 'Events', 'right')
 plots_conf['ht']              = PlotConf('H_{T} [GeV]', 'Events / (BIN GeV)', 'right')
 plots_conf['jet_pt']          = PlotConf('Jet p_{T} [GeV]', 'Events / (BIN GeV)', 'right')
 plots_conf['jet_eta']         = PlotConf('Jet #eta', 'Events', 'right')
-plots_conf['rt2']             = PlotConf('R_{T}^{2}', 'Events', 'left', 0.3, 1.1)
-plots_conf['rt4']             = PlotConf('R_{T}^{4}', 'Events / BIN', 'left', 0.3, 1.05)
+plots_conf['rt2']             = PlotConf('R_{T}^{2}', 'Events', 'left', 0.3, 1.1, 40)
+plots_conf['rt4']             = PlotConf('R_{T}^{4}', 'Events / BIN', 'left', 0.3, 1.05, 30)
 
 plots_conf['pt']  = PlotConf('p_{T} [GeV]', 'Events / (BIN GeV)', 'right')
 plots_conf['eta'] = PlotConf('#eta', 'Events / (BIN GeV)', 'right')
 plots_conf['phi'] = PlotConf('#phi', 'Events / (BIN GeV)', 'right')
+
+
+def get_plot_conf(variable):
+
+    if variable.startswith('h_'):
+        variable = variable[2:]
+
+    if variable not in plots_conf:
+        vartmp = variable[:variable.find('[')]
+        conf = plots_conf.get(vartmp, None)
+    else:
+        conf = plots_conf.get(variable, None)
+
+    if conf is None:
+        last = variable.split('_')[-1]
+
+        if last in plots_conf:
+            conf = plots_conf.get(last, None)
+
+    if conf is None:
+        conf = plots_conf['default']
+
+    return conf
@@ -0,0 +1,318 @@
+# plotter
+# uprootfile.py
+#
+# File backend based on uproot and numpy, ROOT is only imported to convert
+# the objects when they are drawn. Selections are python/numpy expressions
+# (e.g. "(ph_n > 0) & (met_et > 50)") instead of TTree::Draw syntax.
+
+import numpy as np
+import uproot
+
+from plotter.backends import FileBase, load_root
+
+
+# uproot class name prefix -> dtype
+_dtype_prefixes = (
+    ('TH1', 'hist'),
+    ('TH2', 'hist'),
+    ('TH3', 'hist'),
+    ('TProfile', 'hist'),
+    ('TGraph', 'graph'),
+    ('TDirectory', 'dir'),
+    ('TTree', 'tree'),
+    ('TNtuple', 'tree'),
+)
+
+def get_dtype(class_name):
+    for prefix, dtype in _dtype_prefixes:
+        if class_name.startswith(prefix):
+            return dtype
+    return None
+
+
+class Axis:
+
+    def __init__(self, edges):
+        self.edges = edges
+
+    def GetNbins(self):
+        return len(self.edges) - 1
+
+    def GetXmin(self):
+        return float(self.edges[0])
+
+    def GetXmax(self):
+        return float(self.edges[-1])
+
+
+class Hist1D:
+    """
+    Histogram projected with numpy, with the cells laid out as in ROOT
+    (underflow, bins, overflow). Converted to a TH1D with to_root().
+    """
+
+    def __init__(self, name, edges, sumw, sumw2=None, entries=0):
+        self.name = name
+        self.edges = edges
+        self.sumw = sumw
+        self.sumw2 = sumw2
+        self.entries = entries
+
+    def Clone(self):
+        return Hist1D(self.name, self.edges, self.sumw.copy(),
+                      None if self.sumw2 is None else self.sumw2.copy(), self.entries)
+
+    def SetDirectory(self, directory):
+        pass
+
+    def GetName(self):
+        return self.name
+
+    def ClassName(self):
+        return 'TH1D'
+
+    def GetNcells(self):
+        return len(self.sumw)
+
+    def GetSumw2N(self):
+        return 0 if self.sumw2 is None else len(self.sumw2)
+
+    def GetXaxis(self):
+        return Axis(self.edges)
+
+    def Add(self, other):
+        """ Add the cells of a histogram with the same binning """
+        self.sumw += other.sumw
+        if self.sumw2 is not None and other.sumw2 is not None:
+            self.sumw2 += other.sumw2
+        self.entries += other.entries
+
+    def Scale(self, c):
+        # unweighted histograms get their sum of squared weights first, as TH1::Scale
+        if self.sumw2 is None:
+            self.sumw2 = self.sumw.copy()
+        self.sumw *= c
+        self.sumw2 *= c * c
+
+    def to_root(self):
+
+        ROOT = load_root()
+
+        hist = ROOT.TH1D(self.name, self.name, len(self.edges) - 1, self.edges[0], self.edges[-1])
+        hist.SetDirectory(0)
+        ROOT.SetOwnership(hist, True)
+
+        hist.SetContent(self.sumw)
+        if self.sumw2 is not None:
+            hist.Sumw2()
+            hist.GetSumw2().Set(len(self.sumw2), self.sumw2)
+        hist.SetEntries(self.entries)
+
+        return hist
+
+
+class UprootObject:
+    """ Histogram/graph read with uproot, converted with to_root() """
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def to_root(self):
+
+        ROOT = load_root()
+
+        obj = uproot.to_pyroot(self.obj)
+        if hasattr(obj, 'SetDirectory'):
+            obj.SetDirectory(0)
+        ROOT.SetOwnership(obj, True)
+
+        return obj
+
+
+def fill(name, values, weights, binning):
+    """ Fill a Hist1D from the values of a branch, jagged branches are flattened """
+
+    if values.dtype == object:
+        counts = np.fromiter((len(v) for v in values), dtype=np.int64, count=len(values))
+        values = np.concatenate(values) if len(values) else np.empty(0)
+
+        if weights is not None and weights.dtype != object:
+            weights = np.repeat(weights, counts)
+
+    if weights is not None and weights.dtype == object:
+        weights = np.concatenate(weights) if len(weights) else np.empty(0)
+
+    values = np.asarray(values, dtype=np.float64)
+
+    if weights is not None:
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), values.shape)
+
+    if binning is None:
+        finite = values[np.isfinite(values)]
+        if len(finite):
+            xmin, xmax = float(finite.min()), float(finite.max())
+        else:
+            xmin, xmax = 0., 1.
+
+        # keep the maximum inside the last bin
+        if xmax > xmin:
+            xmax += (xmax - xmin) * 1e-6
+        else:
+            xmin, xmax = xmin - 1., xmax + 1.
+
+        nbins = 100
+    else:
+        nbins, xmin, xmax = binning
+
+    edges = np.linspace(xmin, xmax, nbins + 1)
+
+    # 0 is the underflow and nbins+1 the overflow, as in ROOT
+    idx = np.searchsorted(edges, values, side='right')
+
+    sumw = np.bincount(idx, weights=weights, minlength=nbins+2).astype(np.float64)
+    sumw2 = None
+    if weights is not None:
+        sumw2 = np.bincount(idx, weights=weights*weights, minlength=nbins+2)
+
+    return Hist1D(name, edges, sumw, sumw2, len(values))
+
+
+class UprootFile(FileBase):
+
+    # projections made with numpy are not ROOT objects
+    use_disk_cache = False
+
+    def _open(self):
+        return uproot.open(self.path)
+
+    def _read_uuid(self):
+        return str(self._file.file.uuid)
+
+    def _list_entries(self, parent_name, parent_dtype):
+
+        entries = []
+
+        if parent_dtype == 'tree':
+            tree = self._file[parent_name]
+            for b in tree.itervalues(recursive=True):
+                if not b.branches:
+                    entries.append(('branch', parent_name + '//' + b.name, b.name))
+
+        else:
+            cdir = self._file[parent_name] if parent_name else self._file
+
+            seen = set()
+            for name, class_name in cdir.iterclassnames(recursive=False, cycle=False):
+
+                dtype = get_dtype(class_name)
+                if dtype is None or name in seen:
+                    continue
+                seen.add(name)
+
+                if parent_name:
+                    path = parent_name + '/' + name
+                else:
+                    path = name
+
+                entries.append((dtype, path, name))
+
+        return entries
+
+    def read_object(self, path):
+        try:
+            return UprootObject(self._file[path])
+        except (KeyError, uproot.KeyInFileError):
+            return None
+
+    def _read_arrays(self, tree, expressions, entry_start=None, entry_stop=None):
+
+        # all the expressions in one pass over the baskets
+        try:
+            return tree.arrays(expressions, entry_start=entry_start, entry_stop=entry_stop, library='np')
+        except Exception:
+            pass
+
+        # one of them is wrong, read them one by one to find which
+        arrays = {}
+        for expression in expressions:
+            try:
+                arrays.update(tree.arrays([expression], entry_start=entry_start, entry_stop=entry_stop, library='np'))
+            except Exception as e:
+                print('Error reading %s: %s' % (expression, e))
+
+        return arrays
+
+    def _get_tree(self, treename):
+        try:
+            return self._file[treename]
+        except (KeyError, uproot.KeyInFileError):
+            return None
+
+    def tree_entries(self, treename):
+        tree = self._get_tree(treename)
+        return tree.num_entries if tree is not None else 0
+
+    def tree_clusters(self, treename):
+
+        tree = self._get_tree(treename)
+        if tree is None:
+            return []
+
+        offsets = tree.common_entry_offsets()
+
+        return list(zip(offsets[:-1], offsets[1:]))
+
+    def project(self, treename, branches):
+        """ Project a list of (name, selection, binning) of the same tree """
+
+        # the baskets are read and filled in the same loop, the file stays locked
+        hists = [None] * len(branches)
+        with self._lock:
+            for _, hists in self.project_ranges(treename, branches, [(0, self.tree_entries(treename))]):
+                pass
+
+        return hists
+
+    def project_ranges(self, treename, branches, ranges):
+        """
+        Project a list of (name, selection, binning) of the same tree for a list of
+        entry ranges, yields (entries done, hists) after each range
+        """
+
+        tree = self._get_tree(treename)
+        if tree is None:
+            return
+
+        expressions = []
+        for name, selection, _ in branches:
+            for expression in (name, selection):
+                if expression and expression not in expressions:
+                    expressions.append(expression)
+
+        hists = [None] * len(branches)
+        done = 0
+
+        for start, stop in ranges:
+
+            arrays = self._read_arrays(tree, expressions, start, stop)
+
+            for k, (name, selection, binning) in enumerate(branches):
+
+                if name not in arrays or (selection and selection not in arrays):
+                    continue
+
+                # the first range fixes the binning, the next ones are added to it
+                if hists[k] is not None:
+                    axis = hists[k].GetXaxis()
+                    binning = (axis.GetNbins(), axis.GetXmin(), axis.GetXmax())
+
+                hist = fill(name, arrays[name], arrays[selection] if selection else None, binning)
+
+                if hists[k] is None:
+                    hists[k] = hist
+                else:
+                    hists[k].Add(hist)
+
+            done += stop - start
+
+            yield done, hists
@@ -0,0 +1,365 @@
+# plotter
+# workers.py
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from PySide2.QtCore import QObject, QRunnable, Signal
+
+from plotter.backends import open_file, set_threads, to_root, copy_object, load_root
+from plotter.plot_model import PlotModel
+from plotter.search import NameSegment
+
+
+class FileLoaderSignals(QObject):
+    loaded = Signal(int, object)
+    failed = Signal(int, str)
+
+
+class FileLoader(QRunnable):
+    """ Open a file and list its top level in a worker thread """
+
+    def __init__(self, idx, path, index_cache=None, projection_cache=None, backend='root'):
+        super().__init__()
+
+        self.idx = idx
+        self.path = path
+        self.backend = backend
+        self.index_cache = index_cache
+        self.projection_cache = projection_cache
+        self.signals = FileLoaderSignals()
+
+    def run(self):
+
+        try:
+            f = open_file(self.path, self.backend, self.index_cache, self.projection_cache)
+
+            if not f.is_valid():
+                self.signals.failed.emit(self.idx, 'invalid file')
+                return
+
+            f.list_dir('')
+
+        except Exception as e:
+            self.signals.failed.emit(self.idx, str(e))
+            return
+
+        self.signals.loaded.emit(self.idx, f)
+
+
+class FileIndexerSignals(QObject):
+    indexed = Signal(int, object)
+
+
+class FileIndexer(QRunnable):
+    """
+    List a whole file for the search index, once it is loaded. Runs in its
+    own pool, so that opening the other files never waits for it
+    """
+
+    def __init__(self, ifile, root_file):
+        super().__init__()
+
+        self.ifile = ifile
+        self.root_file = root_file
+        self.signals = FileIndexerSignals()
+
+    def run(self):
+
+        # the file can already be browsed, the listing is shared and locked
+        try:
+            segment = NameSegment([ (path, name) for depth, dtype, path, name in self.root_file ])
+        except Exception as e:
+            print('Error indexing file %s: %s' % (self.root_file.path, e))
+            return
+
+        self.signals.indexed.emit(self.ifile, segment)
+
+
+class RootLoaderSignals(QObject):
+    loaded = Signal()
+    failed = Signal(str)
+
+
+class RootLoader(QRunnable):
+    """ Import ROOT in the background, so that the window shows up first """
+
+    def __init__(self):
+        super().__init__()
+        self.signals = RootLoaderSignals()
+
+    def run(self):
+
+        try:
+            load_root()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+
+        self.signals.loaded.emit()
+
+
+# files read concurrently by a draw job
+MAX_FETCH_THREADS = 8
+
+# minimum time between two partial plots in live mode (s)
+LIVE_INTERVAL = 0.3
+
+# time between two checks for a cancelled draw job (s)
+CANCEL_INTERVAL = 0.1
+
+
+class DrawWorkerSignals(QObject):
+    progress = Signal(int, int, int)
+    partial = Signal(int, object, int)
+    finished = Signal(int, object)
+    failed = Signal(int, str)
+
+
+class DrawWorker(QRunnable):
+    """
+    Produce the objects of a plot (reading histograms, projecting branches)
+    in a worker thread. The plot itself is created in the GUI thread.
+
+    In live mode the trees are projected in chunks, and the partial objects
+    are sent (partial signal, with the percentage done) as they are filled.
+
+    With sample_entries the large trees are only sampled (preview), the
+    smallest fraction of entries read is left in preview_fraction.
+    """
+
+    def __init__(self, job_id, files, items, threads=1, live=False, sample_entries=None):
+        super().__init__()
+
+        self.job_id = job_id
+        self.files = files
+        self.items = items
+        self.threads = threads
+        self.sample_entries = sample_entries
+        self.preview_fraction = 1.
+
+        # a preview is quick enough, no need to stream it
+        self.live = live and not sample_entries
+        self.cancelled = False
+        self.signals = DrawWorkerSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def make_object(self, i, obj, copy=False):
+
+        # get_objects already returns objects owned by us, no copy needed,
+        # but the partial objects of the live mode are still being filled
+        if obj is None:
+            return None
+
+        color, opts = self.items[i][3:5]
+
+        return (copy_object(obj) if copy else to_root(obj), color, opts)
+
+    def get_first(self, ifile, path, sel):
+        """ Object of the first chunk, for the automatic binning in live mode """
+
+        chunks = self.files[ifile].iter_objects([(path, sel, None)])
+        try:
+            _, objects = next(chunks)
+        finally:
+            chunks.close()
+
+        return objects[0]
+
+    def run(self):
+
+        # anything escaping here would leave the GUI waiting for this job
+        try:
+            self._run()
+        except Exception as e:
+            print('Error drawing: %s' % e)
+            self.signals.failed.emit(self.job_id, str(e))
+
+    def _run(self):
+
+        # draw jobs run one at a time, so the thread pool can be changed safely here
+        set_threads(self.threads)
+
+        objects = [None] * len(self.items)
+
+        # the same branch without explicit binning (e.g. overlaid from several
+        # files) takes the binning of its first item, so that the histograms
+        # are comparable. Different branches keep their own automatic binning
+        followers = {}
+        firsts = {}
+        for i, item in enumerate(self.items):
+            if '//' in item[2] and PlotModel.getBinning(item) is None:
+                name = item[2].split('//')[-1]
+                if name in firsts:
+                    followers.setdefault(firsts[name], []).append(i)
+                else:
+                    firsts[name] = i
+
+        if self.live:
+            # in live mode the binning comes from the first chunk only
+            for first, rows in followers.items():
+                ifile, _, path, _, _, sel = self.items[first][:6]
+
+                try:
+                    hist = self.get_first(ifile, path, sel)
+                except Exception as e:
+                    print('Error getting %s: %s' % (path, e))
+                    hist = None
+
+                self.share_binning(first, rows, hist)
+
+            requests = [ (item[2], item[5], PlotModel.getBinning(item)) for item in self.items ]
+
+            objects = self.run_live(requests, self.rows_per_file(range(len(self.items))))
+            if objects is None:
+                return
+
+        else:
+            # the first items are projected with everything else, in the single
+            # loop of their tree, and only the items following them after that
+            waiting = { i for rows in followers.values() for i in rows }
+
+            done = set()
+            if not self.fetch([ i for i in range(len(self.items)) if i not in waiting ], objects, done):
+                return
+
+            for first, rows in followers.items():
+                self.share_binning(first, rows, objects[first])
+
+            if waiting and not self.fetch(sorted(waiting), objects, done):
+                return
+
+            objects = [ self.make_object(i, obj) for i, obj in enumerate(objects) ]
+
+        if self.cancelled:
+            return
+
+        if self.sample_entries:
+            self.preview_fraction = min(self.files[item[0]].sampled_fraction(item[2], self.sample_entries) for item in self.items)
+
+        self.signals.finished.emit(self.job_id, objects)
+
+    def share_binning(self, first, rows, hist):
+        """ Give the binning of the (automatically binned) hist of item first to the items rows """
+
+        if hist is None:
+            return
+
+        axis = hist.GetXaxis()
+        binning = [axis.GetNbins(), axis.GetXmin(), axis.GetXmax()]
+
+        # the history keeps the resolved binning of all of them, a replay
+        # looks the first projection up with it
+        ifile, _, path, _, _, sel = self.items[first][:6]
+        if not self.live:
+            self.files[ifile].cache_projection(path, sel, tuple(binning), hist, self.sample_entries)
+
+        for i in [first] + rows:
+            self.items[i][6:9] = binning
+
+    def rows_per_file(self, rows):
+        """ Group the items by file, each file gets all its objects in one go """
+
+        rows_per_file = {}
+        for i in rows:
+            rows_per_file.setdefault(self.items[i][0], []).append(i)
+
+        return rows_per_file
+
+    def fetch(self, rows, objects, done):
+        """ Get the objects of the items rows into objects, reading the files concurrently. False if cancelled """
+
+        rows_per_file = self.rows_per_file(rows)
+        if not rows_per_file:
+            return True
+
+        requests = [ (item[2], item[5], PlotModel.getBinning(item)) for item in self.items ]
+
+        pool = ThreadPoolExecutor(min(len(rows_per_file), MAX_FETCH_THREADS))
+        try:
+            futures = {}
+            for ifile, file_rows in rows_per_file.items():
+                future = pool.submit(self.files[ifile].get_objects, [ requests[i] for i in file_rows ], self.sample_entries)
+                futures[future] = file_rows
+
+            pending = set(futures)
+            while pending:
+
+                # checked while the projections run, not only when one ends
+                finished, pending = wait(pending, CANCEL_INTERVAL, FIRST_COMPLETED)
+                if self.cancelled:
+                    return False
+
+                for future in finished:
+                    file_rows = futures[future]
+
+                    # a failing file leaves its objects missing, the others are still drawn
+                    try:
+                        file_objects = future.result()
+                    except Exception as e:
+                        print('Error getting objects from %s: %s' % (self.files[self.items[file_rows[0]][0]].path, e))
+                        file_objects = [None] * len(file_rows)
+
+                    for i, obj in zip(file_rows, file_objects):
+                        objects[i] = obj
+
+                    done.update(file_rows)
+                    self.signals.progress.emit(self.job_id, len(done), len(self.items))
+
+        finally:
+            # the running projections can not be stopped: a cancelled job does not
+            # wait for them, so that the next job starts right away
+            pool.shutdown(wait=not self.cancelled, cancel_futures=True)
+
+        return True
+
+    def run_live(self, requests, rows_per_file):
+        """ Advance all the files one chunk at a time, returns the objects or None if cancelled """
+
+        chunks = { ifile: self.files[ifile].iter_objects([ requests[i] for i in rows ]) for ifile, rows in rows_per_file.items() }
+        fractions = dict.fromkeys(chunks, 0.)
+        latest = [None] * len(self.items)
+
+        last_emit = time.time()
+
+        with ThreadPoolExecutor(min(len(chunks), MAX_FETCH_THREADS)) as pool:
+            while chunks:
+
+                if self.cancelled:
+                    for c in chunks.values():
+                        c.close()
+                    return None
+
+                futures = { pool.submit(next, c, None): ifile for ifile, c in chunks.items() }
+
+                for future in as_completed(futures):
+                    ifile = futures[future]
+                    rows = rows_per_file[ifile]
+
+                    # a failing file leaves its objects missing, the others are still drawn
+                    try:
+                        step = future.result()
+                    except Exception as e:
+                        print('Error getting objects from %s: %s' % (self.files[ifile].path, e))
+                        step = None
+                        for i in rows:
+                            latest[i] = None
+
+                    if step is None:
+                        del chunks[ifile]
+                        fractions[ifile] = 1.
+                        continue
+
+                    fractions[ifile], file_objects = step
+                    for i, obj in zip(rows, file_objects):
+                        latest[i] = obj
+
+                if chunks and time.time() - last_emit > LIVE_INTERVAL:
+                    percent = int(100 * sum(fractions.values()) / len(fractions))
+                    partial = [ self.make_object(i, obj, copy=True) for i, obj in enumerate(latest) ]
+                    self.signals.partial.emit(self.job_id, partial, percent)
+                    last_emit = time.time()
+
+        return [ self.make_object(i, obj) for i, obj in enumerate(latest) ]